@@ -0,0 +1,163 @@
+import argparse
+import csv
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import generator
+import loaders
+import validation
+
+OUTPUT_DIR = 'output'
+
+# Keys and translations handed to each worker process once, when it starts
+_shared = {}
+
+
+def _init_worker(keys, translations):
+    _shared['keys'] = keys
+    _shared['translations'] = translations
+
+
+# Function to build the list of jobs, one per preset and region default file
+def build_jobs(presets, default_files=None, values_files=None, output_dir=OUTPUT_DIR, populate=()):
+    default_list = loaders.load_default_list() if not default_files else {}
+    jobs = []
+    for i, preset in enumerate(presets):
+        default_file = default_files[i] if default_files else default_list.get(preset)
+        region = default_file or preset
+        jobs.append({
+            'preset': preset,
+            'defaults': default_file,
+            'values': values_files[i] if values_files else None,
+            'output_dir': os.path.join(output_dir, region),
+            'populate': tuple(populate)
+        })
+    return jobs
+
+
+# Function to read jobs from a CSV file with preset, defaults, values and output_dir columns
+def read_jobs(path, output_dir=OUTPUT_DIR, populate=()):
+    jobs = []
+    with open(path, newline='', encoding='utf-8-sig') as file:
+        for row in csv.DictReader(file):
+            default_file = row.get('defaults') or loaders.load_default_list().get(row['preset'])
+            jobs.append({
+                'preset': row['preset'],
+                'defaults': default_file,
+                'values': row.get('values') or None,
+                'output_dir': row.get('output_dir') or os.path.join(output_dir, default_file or row['preset']),
+                'populate': tuple(populate)
+            })
+    return jobs
+
+
+# Function to check that no two jobs write into the same folder, where the last one would silently win
+def check_output_dirs(jobs):
+    seen = {}
+    for job in jobs:
+        output_dir = os.path.normcase(os.path.abspath(job['output_dir']))
+        if output_dir in seen:
+            raise ValueError(f"{seen[output_dir]['preset']} ({seen[output_dir]['defaults']}) and {job['preset']} ({job['defaults']}) "
+                             f"would both write into {job['output_dir']}, give them different output_dir values")
+        seen[output_dir] = job
+
+
+# Function to generate the data.csv and commits.yml of a single job, unless its values fail validation
+def run_job(job, validate=True):
+    preset_keys = loaders.load_preset(job['preset'])
+    categories = loaders.load_categories(job['preset'])
+    defaults = loaders.load_defaults(job['defaults']) if job['defaults'] and job['populate'] else {}
+    values = generator.read_values(job['values']) if job['values'] else None
+    row = generator.build_dataset(_shared['keys'], _shared['translations'], preset_keys, categories,
+                                  defaults, values, job['populate'])
+    violations = validation.validate_row(row) if validate else []
+    if violations:
+        examples = ', '.join(f"{key} = '{value}': {problem}" for key, value, problem in violations[:3])
+        raise ValueError(f"{len(violations)} values failed validation ({examples}{', ...' if len(violations) > 3 else ''})")
+
+    os.makedirs(job['output_dir'], exist_ok=True)
+    data_path = os.path.join(job['output_dir'], 'data.csv')
+    generator.write_dataset(row, data_path)
+    # A newly generated region needs every column, whatever the shared commits.yml holds
+    generator.write_commits(None, os.path.join(job['output_dir'], 'commits.yml'))
+    return data_path
+
+
+# Function to run every job in a process pool, returning the (job, data path or error) of each one
+def run_batch(jobs, max_workers=None, validate=True):
+    check_output_dirs(jobs)
+    # Parsed once here and handed to the workers instead of being parsed by each of them
+    keys = loaders.load_keys()
+    translations = loaders.load_translations()
+
+    results = []
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                             initargs=(keys, translations)) as executor:
+        futures = {executor.submit(run_job, job, validate): job for job in jobs}
+        for future in as_completed(futures):
+            try:
+                results.append((futures[future], future.result()))
+            except Exception as e:
+                results.append((futures[future], e))
+    return results
+
+
+# Function to parse the command-line arguments
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Generate the datasets of several regions in parallel.')
+    parser.add_argument('presets', nargs='*', help='preset groups of keys, e.g. Vanuatu Fiji')
+    parser.add_argument('--jobs', help='CSV file with preset, defaults, values and output_dir columns')
+    parser.add_argument('--defaults', nargs='*', help='default file of each preset (defaults to config/defaultlist.csv)')
+    parser.add_argument('--values', nargs='*', help='values file of each preset')
+    parser.add_argument('--populate', nargs='*', default=[], choices=['basic', 'advanced', 'zero'],
+                        help='populate empty keys with basic defaults, advanced defaults and/or 0')
+    parser.add_argument('--output-dir', default=OUTPUT_DIR, help='directory holding one folder per region')
+    parser.add_argument('--skip-validation', action='store_true',
+                        help='write data.csv even when values are missing, not numeric or out of range')
+    parser.add_argument('--workers', type=int, help='number of worker processes')
+    parser.add_argument('--merge-into', help='also merge every generated row into this multi-row data.csv, by geo_id')
+    args = parser.parse_args(argv)
+    for option in ('defaults', 'values'):
+        if getattr(args, option) and len(getattr(args, option)) != len(args.presets):
+            parser.error(f"--{option} needs one entry per preset")
+    if not args.presets and not args.jobs:
+        parser.error("give at least one preset or a --jobs file")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    jobs = build_jobs(args.presets, args.defaults, args.values, args.output_dir, args.populate)
+    if args.jobs:
+        jobs += read_jobs(args.jobs, args.output_dir, args.populate)
+
+    try:
+        results = run_batch(jobs, args.workers, not args.skip_validation)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    failures = 0
+    generated = []
+    for job, result in results:
+        if isinstance(result, Exception):
+            failures += 1
+            print(f"{job['preset']} ({job['defaults']}): failed: {result}", file=sys.stderr)
+        else:
+            generated.append(result)
+            print(f"{job['preset']} ({job['defaults']}): {result} generated successfully")
+
+    if args.merge_into and generated:
+        # Merged in a single pass over the combined file
+        try:
+            generator.upsert_datasets((generator.read_values(path) for path in generated), args.merge_into)
+        except ValueError as e:
+            print(f"{args.merge_into} was not written: {e}", file=sys.stderr)
+            return 1
+        print(f"{len(generated)} rows merged into {args.merge_into}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
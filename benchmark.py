@@ -0,0 +1,289 @@
+import argparse
+import csv
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import generator
+import loaders
+import migration
+import validation
+from generator import LEVELS, TYPOLOGIES
+
+SIZES = (700, 5000, 50000)
+REGIONS = 100
+PRESET = 'Synthetic'
+RESULTS_DIR = os.path.join('output', 'benchmarks')
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ethelper.py')
+ICONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'icons')
+
+# Largest keys.csv for which the application is timed with every section rendered; larger ones
+# are timed one section page at a time
+ALL_SECTIONS_LIMIT = 5000
+
+# Slowdown (as a ratio) and minimum difference (in milliseconds) for a step to count as a regression
+THRESHOLD = 1.5
+MIN_DIFFERENCE_MS = 10.0
+
+TEXT_KEYS = ('geo_id', 'name', 'country', 'analysis_year')
+
+
+# Function to build synthetic keys and translations, count keys in total
+def make_keys(count):
+    keys = list(TEXT_KEYS) + [f'synthetic_{i:05d}_final_demand' for i in range(count - len(TEXT_KEYS))]
+    translations = [key.replace('_', ' ').capitalize() for key in keys]
+    return keys, translations
+
+
+def _write_rows(path, rows):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        csv.writer(file, lineterminator='\n').writerows(rows)
+
+
+# Function to write a synthetic copy of the files read by the application into root: keys, translations,
+# a preset holding every other key, its categories, one defaults file per region and the icons
+# Returns the names of the regions
+def build_workspace(root, count, regions):
+    keys, translations = make_keys(count)
+    preset_keys = list(TEXT_KEYS) + keys[len(TEXT_KEYS)::2]
+
+    # Most preset keys are spread over every level and typology; some are uncategorised or hidden
+    category_rows = []
+    for i, key in enumerate(preset_keys):
+        if i % 20 == 19:
+            continue
+        typology = 'Other' if i % 50 == 49 else TYPOLOGIES[i % len(TYPOLOGIES)]
+        category_rows.append((key, LEVELS[i % len(LEVELS)], typology))
+
+    _write_rows(os.path.join(root, 'variables', 'keys.csv'), [keys])
+    _write_rows(os.path.join(root, 'variables', 'translations.csv'), [keys, translations])
+    _write_rows(os.path.join(root, 'presets', f'{PRESET}.csv'), [preset_keys])
+    _write_rows(os.path.join(root, 'presets', 'categories', PRESET, 'categories.csv'), list(zip(*category_rows)))
+
+    region_names = [f'region_{r:03d}' for r in range(regions)]
+    for r, region in enumerate(region_names):
+        values = [region, region, PRESET, '2023'] + [str(((i + r) % 97) / 97) for i in range(len(preset_keys) - len(TEXT_KEYS))]
+        _write_rows(os.path.join(root, 'presets', 'defaults', f'{region}.csv'), [preset_keys, values])
+    _write_rows(os.path.join(root, 'config', 'defaultlist.csv'), [[PRESET], [region_names[0]]])
+
+    shutil.copytree(ICONS_DIR, os.path.join(root, 'icons'))
+    shutil.copyfile(os.path.join(root, 'icons', 'flags', 'Vanuatu.png'), os.path.join(root, 'icons', 'flags', f'{PRESET}.png'))
+    os.makedirs(os.path.join(root, 'output'), exist_ok=True)
+    generator.write_commits(path=os.path.join(root, 'output', 'commits.yml'))
+    return region_names
+
+
+# Function to time a function, returning the fastest of repeat runs in milliseconds and the last result
+def timed(function, repeat=1, setup=None):
+    best = None
+    result = None
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        result = function()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best, 3), result
+
+
+# Function to time each step of the generation pipeline on a synthetic workspace, for every region
+def bench_pipeline(root, regions, repeat=3):
+    keys_path = os.path.join(root, 'variables', 'keys.csv')
+    translations_path = os.path.join(root, 'variables', 'translations.csv')
+    presets_dir = os.path.join(root, 'presets')
+    output_dir = os.path.join(root, 'output', 'regions')
+    migrate_dir = os.path.join(root, 'migrate')
+    timings = {}
+
+    def load_preset():
+        return (loaders.load_keys(keys_path), loaders.load_translations(translations_path),
+                loaders.load_preset(PRESET, presets_dir), loaders.load_categories(PRESET, presets_dir))
+
+    timings['preset_loading'], (keys, translations, preset_keys, categories) = timed(load_preset, repeat, loaders.clear_cache)
+    timings['preset_loading_cached'], _ = timed(load_preset, repeat)
+
+    timings['category_lookup'], key_index = timed(
+        lambda: generator.build_key_index(keys, translations, preset_keys, categories), repeat)
+
+    timings['defaults_loading'], defaults = timed(
+        lambda: [loaders.load_defaults(region, presets_dir) for region in regions], 1)
+
+    def populate():
+        rows = []
+        for region_defaults in defaults:
+            row = dict.fromkeys(keys, "")
+            generator.fill_non_preset(row, key_index)
+            generator.fill_defaults(row, key_index, 'Basic', region_defaults)
+            generator.fill_defaults(row, key_index, 'Advanced', region_defaults)
+            generator.fill_zero(row, key_index)
+            rows.append(row)
+        return rows
+
+    timings['default_population'], rows = timed(populate, repeat)
+    timings['validation'], _ = timed(lambda: [validation.validate_row(row) for row in rows], repeat)
+
+    paths = [os.path.join(output_dir, region, 'data.csv') for region in regions]
+
+    def generate():
+        for row, path in zip(rows, paths):
+            generator.write_dataset(row, path)
+
+    timings['dataset_generation'], _ = timed(generate, repeat)
+    merged_path = os.path.join(root, 'output', 'merged.csv')
+    timings['dataset_merge'], _ = timed(lambda: generator.upsert_datasets(rows, merged_path), repeat)
+
+    def copy():
+        for region, path in zip(regions, paths):
+            os.makedirs(os.path.join(migrate_dir, region), exist_ok=True)
+            migration.copy_if_changed(path, os.path.join(migrate_dir, region, 'data.csv'))
+
+    timings['migration_copy'], _ = timed(copy, repeat, lambda: shutil.rmtree(migrate_dir, ignore_errors=True))
+    timings['migration_copy_unchanged'], _ = timed(copy, repeat)
+    return timings
+
+
+def _last_profile(root):
+    path = os.path.join(root, 'output', 'profile.log')
+    if not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        lines = file.read().splitlines()
+    return json.loads(lines[-1]) if lines else {}
+
+
+# Function to time reruns of the application headlessly with Streamlit's AppTest, from opening the
+# Dataset Generation page to generating data.csv, with the rerun profile logged by the application
+def bench_app(root, render_mode='All Sections', timeout=600):
+    from streamlit.testing.v1 import AppTest
+
+    timings = {}
+    cwd = os.getcwd()
+    os.chdir(root)
+    try:
+        app = AppTest.from_file(APP_PATH, default_timeout=timeout)
+
+        def rerun(name, action):
+            start = time.perf_counter()
+            action()
+            timings[f'{name}_ms'] = round((time.perf_counter() - start) * 1000, 3)
+            if app.exception:
+                raise RuntimeError(f"{name}: {app.exception[0].message}")
+            profile = _last_profile(root)
+            for step in ('total', 'csv_loading', 'category_loop', 'widget_creation', 'chart_rendering', 'file_writes'):
+                if f'{step}_ms' in profile:
+                    timings[f'{name}_{step}_ms'] = profile[f'{step}_ms']
+
+        def button(label):
+            return next(b for b in app.sidebar.button if b.label == label)
+
+        def checkbox(label):
+            return next(c for c in app.sidebar.checkbox if c.label == label)
+
+        rerun('home', app.run)
+        checkbox('Enable Debugging').check().run()
+        rerun('home_profiled', lambda: checkbox('Export Timings to output/profile.log').check().run())
+        app.session_state['render_mode'] = render_mode
+        rerun('open_generation', lambda: app.sidebar.selectbox[0].select('Dataset Generation').run())
+        rerun('populate_basic', lambda: button('Populate Empty Basic Keys with Default').click().run())
+        rerun('populate_zero', lambda: button('Populate Empty Values with 0').click().run())
+        rerun('generate', lambda: button('Generate Dataset').click().run())
+        if render_mode == 'All Sections':
+            rerun('selected_section', lambda: next(r for r in app.sidebar.radio if r.label == 'Rendering Mode').set_value('Selected Section').run())
+        timings['render_mode'] = render_mode
+        timings['widgets'] = _last_profile(root).get('widgets')
+    finally:
+        os.chdir(cwd)
+    return timings
+
+
+# Function to run the benchmarks of every size, each in its own temporary workspace
+def run_benchmarks(sizes=SIZES, regions=REGIONS, repeat=3, app=True, timeout=600, all_sections_limit=ALL_SECTIONS_LIMIT):
+    results = {}
+    for size in sizes:
+        root = tempfile.mkdtemp(prefix=f'ethelper-bench-{size}-')
+        try:
+            region_names = build_workspace(root, size, regions)
+            timings = {f'{name}_ms': value for name, value in bench_pipeline(root, region_names, repeat).items()}
+            if app:
+                render_mode = 'All Sections' if size <= all_sections_limit else 'Selected Section'
+                timings.update({f'app_{name}': value for name, value in bench_app(root, render_mode, timeout).items()})
+            results[str(size)] = timings
+        finally:
+            loaders.clear_cache()
+            shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+# Function to list the steps that got slower than in a baseline, as (size, step, baseline ms, current ms)
+def compare(results, baseline, threshold=THRESHOLD, min_difference=MIN_DIFFERENCE_MS):
+    regressions = []
+    for size, timings in results.items():
+        for step, value in timings.items():
+            previous = baseline.get(size, {}).get(step)
+            if not step.endswith('_ms') or previous is None or value is None:
+                continue
+            if value > previous * threshold and value - previous > min_difference:
+                regressions.append((size, step, previous, value))
+    return regressions
+
+
+# Function to parse the command-line arguments
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the generation pipeline on synthetic keys, presets and regions.')
+    parser.add_argument('--sizes', nargs='*', type=int, default=list(SIZES), help='numbers of keys in keys.csv')
+    parser.add_argument('--regions', type=int, default=REGIONS, help='number of regions (defaults files) per size')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each step, the fastest is kept')
+    parser.add_argument('--skip-app', action='store_true', help='do not time the application through AppTest')
+    parser.add_argument('--all-sections-limit', type=int, default=ALL_SECTIONS_LIMIT,
+                        help='largest number of keys for which the application renders every section')
+    parser.add_argument('--timeout', type=int, default=600, help='seconds allowed for each application rerun')
+    parser.add_argument('--output', help='results file (defaults to output/benchmarks/benchmark-<time>.json)')
+    parser.add_argument('--baseline', help='results file of an earlier run to check for regressions')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='slowdown ratio over the baseline reported as a regression')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run_benchmarks(args.sizes, args.regions, args.repeat, not args.skip_app, args.timeout,
+                             args.all_sections_limit)
+
+    for size, timings in results.items():
+        print(f"{size} keys, {args.regions} regions:")
+        for step, value in timings.items():
+            print(f"  {step:<45} {value}")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"benchmark-{time.strftime('%Y%m%d%H%M%S')}.json")
+    report = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'regions': args.regions,
+        'repeat': args.repeat,
+        'results': results
+    }
+    with generator.atomic_write(output) as file:
+        json.dump(report, file, indent=2)
+    print(f"Results saved to {output}")
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for size, step, previous, value in regressions:
+            print(f"Regression: {size} keys, {step}: {previous} ms -> {value} ms", file=sys.stderr)
+        if regressions:
+            return 1
+        print(f"No regressions against {args.baseline}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
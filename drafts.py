@@ -0,0 +1,62 @@
+import os
+import sqlite3
+import time
+from contextlib import closing
+
+DRAFTS_PATH = os.path.join('output', 'drafts.sqlite3')
+# Drafts not changed for this many seconds are deleted
+DRAFT_MAX_AGE = 30 * 24 * 60 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS drafts (
+    owner TEXT NOT NULL,
+    preset TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (owner, preset, key)
+)
+"""
+
+
+# Function to open the drafts database, creating it on first use
+def connect(path=DRAFTS_PATH):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    connection = sqlite3.connect(path, timeout=10)
+    # The write-ahead log keeps saved drafts intact if the server stops mid-write
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute(SCHEMA)
+    return connection
+
+
+# Function to load the saved values of a draft as a {key: value} dict
+def load_draft(owner, preset, path=DRAFTS_PATH):
+    with closing(connect(path)) as connection:
+        rows = connection.execute('SELECT key, value FROM drafts WHERE owner = ? AND preset = ?', (owner, preset))
+        return dict(rows.fetchall())
+
+
+# Function to save the changed values of a draft in a single transaction
+def save_changes(owner, preset, changes, path=DRAFTS_PATH):
+    if not changes:
+        return
+    now = time.time()
+    with closing(connect(path)) as connection, connection:
+        connection.executemany(
+            'INSERT INTO drafts (owner, preset, key, value, updated) VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT (owner, preset, key) DO UPDATE SET value = excluded.value, updated = excluded.updated',
+            [(owner, preset, key, str(value), now) for key, value in changes.items()]
+        )
+
+
+
+# Function to delete the drafts (every preset of an owner) not changed within the maximum age; returns the rows deleted
+def prune_drafts(max_age=DRAFT_MAX_AGE, path=DRAFTS_PATH):
+    with closing(connect(path)) as connection, connection:
+        cursor = connection.execute(
+            'DELETE FROM drafts WHERE owner IN (SELECT owner FROM drafts GROUP BY owner HAVING MAX(updated) < ?)',
+            (time.time() - max_age,)
+        )
+        return cursor.rowcount
@@ -1,9 +1,23 @@
 import streamlit as st
 import pandas as pd
 import os
+import sys
 import time
-import shutil
-import matplotlib.pyplot as plt
+import io
+import uuid
+import loaders
+import generator
+import migration
+import validation
+import drafts
+import importer
+import search
+import profiling
+import localstack
+from generator import LEVELS, TYPOLOGIES
+
+# Timings and counts of this rerun, shown when debugging is enabled
+profiler = profiling.RerunProfiler()
 
 # Ensure the output directory exists
 if not os.path.exists('output'):
@@ -13,21 +27,27 @@ if not os.path.exists('output'):
 if 'dataset_generated' not in st.session_state:
     st.session_state['dataset_generated'] = False
 
-# Function to create a pie chart
+# Function to create a pie chart as PNG bytes, cached per percentage and title
+@st.cache_data(show_spinner=False, max_entries=404)
 def create_pie_chart(percentage, title):
-    fig, ax = plt.subplots()
+    # Imported here so that startup does not pay for matplotlib when the charts are off
+    from matplotlib.figure import Figure
+
+    # A standalone Figure is not tracked by pyplot, so it is freed once rendered
+    fig = Figure()
+    ax = fig.subplots()
     ax.pie([percentage, 100 - percentage], colors=['#1f77b4', '#d3d3d3'], startangle=90, counterclock=False)
     ax.text(0, 0, f'{percentage}%', ha='center', va='center', fontsize=12, color='white')
     ax.set_title(title, fontsize=12, color='white')
     fig.patch.set_facecolor('black')
-    return fig
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', facecolor=fig.get_facecolor())
+    return buffer.getvalue()
 
 # Function to load preset keys from a CSV file
 def load_preset(preset_name):
     try:
-        preset_df = pd.read_csv(f'presets/{preset_name}.csv', header=None)
-        preset_keys = preset_df.iloc[0].tolist()
-        return preset_keys
+        return loaders.load_preset(preset_name)
     except FileNotFoundError:
         st.error(f"Preset file '{preset_name}.csv' not found in the 'presets' directory.")
         return []
@@ -35,13 +55,7 @@ def load_preset(preset_name):
 # Function to load categories for a preset
 def load_categories(preset_name):
     try:
-        categories_df = pd.read_csv(f'presets/categories/{preset_name}/categories.csv', header=None)
-        categories = {
-            'keys': categories_df.iloc[0].tolist(),
-            'level': [level.capitalize() for level in categories_df.iloc[1].tolist()],
-            'typology': [typology.capitalize() for typology in categories_df.iloc[2].tolist()]
-        }
-        return categories
+        return loaders.load_categories(preset_name)
     except FileNotFoundError:
         st.error(f"Category file for '{preset_name}' not found in the 'presets/categories' directory.")
         return {}
@@ -49,9 +63,7 @@ def load_categories(preset_name):
 # Function to load default values for a preset
 def load_defaults(default_file):
     try:
-        defaults_df = pd.read_csv(f'presets/defaults/{default_file}.csv', header=None)
-        defaults = dict(zip(defaults_df.iloc[0], defaults_df.iloc[1]))
-        return defaults
+        return loaders.load_defaults(default_file)
     except FileNotFoundError:
         st.error(f"Default file '{default_file}.csv' not found in the 'presets/defaults' directory.")
         return {}
@@ -59,40 +71,208 @@ def load_defaults(default_file):
 # Function to load the default file name for a preset from the defaultlist.csv
 def get_default_file(preset_name):
     try:
-        defaultlist_df = pd.read_csv('config/defaultlist.csv', header=None)
-        default_dict = dict(zip(defaultlist_df.iloc[0], defaultlist_df.iloc[1]))
-        return default_dict.get(preset_name, None)
+        return loaders.load_default_list().get(preset_name, None)
     except FileNotFoundError:
         st.error("defaultlist.csv not found in the 'presets' directory.")
         return None
 
-# Function to get the most recent migration folder
-def get_most_recent_migration():
-    migrate_path = os.path.join('..', 'etlocal', 'db', 'migrate')
-    list_of_folders = [f for f in os.listdir(migrate_path) if os.path.isdir(os.path.join(migrate_path, f))]
-    if list_of_folders:
-        most_recent_folder = max(list_of_folders, key=lambda f: os.path.getctime(os.path.join(migrate_path, f)))
-        return most_recent_folder
+# Function to index the keys of a preset by level and typology, cached across reruns
+@st.cache_data(show_spinner=False)
+def build_key_index(keys, translations, preset_keys, categories):
+    return generator.build_key_index(keys, translations, preset_keys, categories)
+
+# Function to list the sections of the Data Entry Form as (label, level, typology, entries)
+def list_sections(key_index):
+    sections = [
+        (f"{level} - {typology}", level, typology, key_index['sections'][(level, typology)])
+        for level in LEVELS
+        for typology in TYPOLOGIES
+    ]
+    sections.append(('Uncategorised', 'N/A', 'N/A', key_index['uncategorised']))
+    return sections
+
+# Function to count the keys of a section that have a value in the session state
+def count_completed(entries):
+    return sum(1 for key, _, _ in entries if st.session_state[key] != "")
+
+# Function to recount the completed keys of the given sections (all of them by default) into the session state
+def refresh_completion(sections, labels=None):
+    counts = st.session_state.setdefault('section_completion', {})
+    for label, _, _, entries in sections:
+        if labels is None or label in labels:
+            counts[label] = count_completed(entries)
+
+# Function to render the text inputs of a section
+def render_key_inputs(entries, user_input):
+    for key, translation, _ in entries:
+        # The widget reads its value from the session state through its key
+        user_input[key] = st.text_input(f"Enter value for {translation} ({key})", key=key)
+    profiler.count('text_inputs', len(entries))
+    profiler.count('widgets', len(entries))
+    profiler.count('elements', len(entries))
+
+# Function to render a section, inside a form that commits all of its values at once in batch entry mode
+def render_section(section, entries, user_input, batch_mode, sections):
+    label = section[0]
+    if not entries:
+        return
+    if batch_mode:
+        with st.form(f"form_{label}"):
+            render_key_inputs(entries, user_input)
+            st.form_submit_button(f'Save {label}', on_click=refresh_completion, args=(sections, [label]))
+        profiler.count('forms')
+        profiler.count('containers')
+        profiler.count('widgets')
+        profiler.count('elements')
     else:
+        render_key_inputs(entries, user_input)
+
+# Function to get the draft name of this browser, a random one unless the URL holds one, so that
+# users of a shared server do not overwrite each other's drafts while a refresh or bookmark keeps the name
+def draft_name_from_url():
+    name = st.query_params.get('draft', '').strip()
+    if not name:
+        name = uuid.uuid4().hex[:8]
+        st.query_params['draft'] = name
+    return name
+
+# Function to restore the saved draft of an owner and preset into the session state, once per draft
+def restore_draft(owner, preset, keys):
+    draft_id = (owner, preset)
+    if st.session_state.get('draft_id') == draft_id:
+        return
+    known_keys = set(keys)
+    saved = {key: value for key, value in drafts.load_draft(owner, preset).items() if key in known_keys}
+    st.session_state.update(saved)
+    st.session_state['draft_id'] = draft_id
+    # Values carried over from the previous preset or draft differ from the saved ones, so they are saved next
+    st.session_state['draft_snapshot'] = saved
+    st.session_state['completion_stale'] = True
+
+# Function to save only the keys changed since the last save into the current draft
+# Keys never saved are compared with their starting value: empty, or "0" for the keys outside the preset
+def save_draft(keys, non_preset):
+    snapshot = st.session_state['draft_snapshot']
+    changes = {
+        key: st.session_state[key] for key in keys
+        if st.session_state[key] != snapshot.get(key, '0' if key in non_preset else '')
+    }
+    if changes:
+        owner, preset = st.session_state['draft_id']
+        drafts.save_changes(owner, preset, changes)
+        snapshot.update(changes)
+
+# Function to import the values of a data.csv, migration folder or spreadsheet into the session state in one batch
+def import_values(source, name, geo_id, only_empty, keys, translations):
+    column_index = importer.build_column_index(keys, translations)
+    try:
+        values, unmapped = importer.read_values(importer.iter_rows(source, name), column_index, geo_id or None)
+    except Exception as e:
+        st.sidebar.error(f"Failed to import values: {e}")
+        return
+    if not values:
+        st.sidebar.error("No dataset found to import" + (f" for geo_id '{geo_id}'" if geo_id else ""))
+        return
+    if only_empty:
+        values = {key: value for key, value in values.items() if st.session_state[key] == ""}
+    st.session_state.update(values)
+    st.session_state['completion_stale'] = True
+    message = f"{len(values)} values imported"
+    if unmapped:
+        message += f", {len(unmapped)} columns not found in keys.csv were skipped"
+    st.sidebar.success(message)
+
+# Function to build the rows of the dataset grid as (key, translation, level, typology), with their search index
+@st.cache_data(show_spinner=False)
+def build_grid(keys, translations, categories, extra_keys):
+    category_lookup = {}
+    if categories:
+        for key, level, typology in zip(categories['keys'], categories['level'], categories['typology']):
+            category_lookup.setdefault(key, (level, typology))
+    rows = [
+        (key, translation) + category_lookup.get(key, ('', ''))
+        for key, translation in list(zip(keys, translations)) + [(key, '') for key in extra_keys]
+    ]
+    return rows, search.build_search_index(rows)
+
+# Labels of the profiled steps and counts shown in the sidebar; elements, widgets and containers are counted where
+# the key form, progress charts and grid create them, the parts of the page that grow with keys.csv
+PROFILE_LABELS = {
+    'csv_loading': 'CSV loading',
+    'category_loop': 'Category loop',
+    'widget_creation': 'Widget creation',
+    'chart_rendering': 'Chart rendering',
+    'file_writes': 'File writes',
+    'text_inputs': 'Text inputs',
+    'forms': 'Forms',
+    'widgets': 'Widgets',
+    'elements': 'Elements',
+    'containers': 'Containers'
+}
+
+# Function to estimate the size of the session state, as (entries, bytes)
+def session_state_size():
+    entries = 0
+    size = 0
+    for name in list(st.session_state.keys()):
+        value = st.session_state[name]
+        entries += 1
+        size += sys.getsizeof(name) + sys.getsizeof(value)
+        if isinstance(value, dict):
+            size += sum(sys.getsizeof(item) for pair in value.items() for item in pair)
+    return entries, size
+
+# Function to show the timing breakdown and counts of this rerun in the sidebar, optionally logging them
+def show_profile(menu, export):
+    entries, size = session_state_size()
+    record = profiler.as_record(menu=menu, session_state_entries=entries, session_state_kb=round(size / 1024, 1))
+    lines = ["| Step | Value |", "| --- | --- |"]
+    lines += [f"| {PROFILE_LABELS.get(name, name)} | {seconds * 1000:.1f} ms |" for name, seconds in profiler.timings.items()]
+    lines.append(f"| Total | {record['total_ms']:.1f} ms |")
+    lines += [f"| {PROFILE_LABELS.get(name, name)} | {value} |" for name, value in profiler.counts.items()]
+    lines.append(f"| Session state | {entries} entries, {record['session_state_kb']} KB |")
+    with st.sidebar.expander('Rerun Profile', expanded=True):
+        st.markdown('\n'.join(lines))
+    if export:
+        profiler.export(**{name: record[name] for name in ('menu', 'session_state_entries', 'session_state_kb')})
+
+# Function to get the (mtime, size) stamp of a file, or None when it does not exist
+def file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
         return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+# Function to find the keys changed since data.csv was last written, as {key: (old value, new value)}
+# Returns None when data.csv has no row with the same geo_id to compare with
+def dataset_changes(user_input, merge):
+    path = generator.OUTPUT_PATH
+    geo_id = user_input.get('geo_id') if merge else None
+    stamp = file_stamp(path)
+    written = st.session_state.get('last_written')
+    if stamp is not None and written and written['stamp'] == stamp and written['geo_id'] == geo_id:
+        # data.csv is unchanged since this session wrote it, so it does not need to be read again
+        old_row = written['row']
+    else:
+        old_row = generator.read_dataset_row(path, geo_id)
+    # A row for another geo_id (when overwriting) has nothing in common with this one
+    if old_row is None or old_row.get('geo_id') != user_input.get('geo_id'):
+        return None
+    return generator.diff_rows(old_row, user_input)
 
-# Function to update the CSVImporter.run command in the required .rb file
-def update_rb_file(migration_name):
-    base_path = os.path.abspath(os.path.join(os.getcwd(), '..'))
-    rb_file_path = os.path.join(base_path, 'etlocal', 'db', 'migrate', f'{migration_name}.rb')
-
-    with open(rb_file_path, 'r') as file:
-        lines = file.readlines()
-
-    with open(rb_file_path, 'w') as file:
-        for line in lines:
-            if 'CSVImporter.run' in line:
-                line = line.replace('CSVImporter.run(data_path, commits_path)', 'CSVImporter.run(data_path, commits_path, create_missing_datasets: true)')
-            file.write(line)
+# Function to remember the row written to data.csv, to find the dirty keys of the next generation
+def remember_written(user_input, merge):
+    st.session_state['last_written'] = {
+        'stamp': file_stamp(generator.OUTPUT_PATH),
+        'geo_id': user_input.get('geo_id') if merge else None,
+        'row': dict(user_input)
+    }
 
 # Load the keys CSV file
 try:
-    df_keys = pd.read_csv('variables/keys.csv', header=None)  # Read without header
+    with profiler.section('csv_loading'):
+        keys = loaders.load_keys()
     st.image('icons/logos.png', width=1000)
     col1, col2 = st.columns([1, 10])  # Adjust the ratio as needed
 
@@ -118,54 +298,48 @@ try:
             unsafe_allow_html=True
         )
 except FileNotFoundError:
-    df_keys = pd.DataFrame()
     st.error("variables/keys.csv not found. Please ensure the file is in the correct directory.")
     st.stop()
 
 # Load the translations CSV file
 try:
-    df_translations = pd.read_csv('variables/translations.csv', header=None)  # Read without header
+    with profiler.section('csv_loading'):
+        translations = loaders.load_translations()
 except FileNotFoundError:
-    df_translations = pd.DataFrame()
     st.error("variables/translations.csv not found. Please ensure the file is in the correct directory.")
     st.stop()
 
-# Ensure the keys CSV file is not empty and has content
-if df_keys.empty or df_keys.shape[1] == 0:
+# Ensure the keys and translations CSV files are not empty and have content
+if not keys:
     st.error("variables/keys.csv is empty or improperly formatted. Please ensure the file has the correct format.")
     st.stop()
-else:
-    # Extract keys from the first row of keys.csv
-    keys = df_keys.iloc[0].tolist()
-
-    # Extract translations from the second row of translations.csv
-    if df_translations.empty or df_translations.shape[1] == 0:
-        st.error("variables/translations.csv is empty or improperly formatted. Please ensure the file has the correct format.")
-        st.stop()
-    else:
-        translations = df_translations.iloc[1].tolist()
+elif not translations:
+    st.error("variables/translations.csv is empty or improperly formatted. Please ensure the file has the correct format.")
+    st.stop()
 
-# Initialize all keys in the session state
+# Initialize all keys in the session state, re-assigning existing values so that
+# Streamlit keeps them even when their widget is not rendered in this run
 for key in keys:
-    if key not in st.session_state:
-        st.session_state[key] = ""
+    st.session_state[key] = st.session_state.get(key, "")
 
 # Create a sidebar menu
 menu = st.sidebar.selectbox(
     "Select a Menu",
-    ("Home", "Dataset Generation", "Dataset Migration", "Dataset Visualisation")
+    ("Home", "Dataset Generation", "Dataset Migration", "Dataset Visualisation", "Local Testing")
 )
 
-# Add checkbox for enabling or disabling debugging
+# Add checkbox for enabling or disabling debugging, which shows a timing breakdown of each rerun
 debug_mode = st.sidebar.checkbox('Enable Debugging')
+export_profile = debug_mode and st.sidebar.checkbox('Export Timings to output/profile.log')
 
 if menu == "Home":
     st.title('Dataset Generator for the ETM')
     st.write("Welcome to the dataset generator for the Energy Transition Model. This tool is used to create the files essential for dataset migrations within ETLocal, the ETM repository responsible for exporting datasets to ETSource.")
-    st.write("There are 3 key menus that can be accessed through the toolbar on the left: Dataset Generation, Dataset Migration, and Dataset Visualisation")
+    st.write("There are 4 key menus that can be accessed through the toolbar on the left: Dataset Generation, Dataset Migration, Dataset Visualisation, and Local Testing")
     st.write("Dataset Generation allows users to input values for each key variable (key) that the ETM relies on to function. Users can generate the dataset into a data.csv file, which by default is created in the 'output' folder. Users can also download this file into their 'downloads' folder if desired.")
     st.write("Dataset Migration allows users to export the data.csv to the relevant migration in ETLocal, specifying the migration name in full.")
     st.write("Dataset Visualisation shows the current state of data.csv in a tabular and searchable format.")
+    st.write("Local Testing starts a local run of the ETM (etengine and etmodel) with the migrated dataset.")
     # Display dataset generation status
     if st.session_state['dataset_generated']:
         st.write("**Current Dataset Status:** DATASET GENERATED (✓)")
@@ -182,17 +356,31 @@ elif menu == "Dataset Generation":
     st.write('Use the menu on the side to select a preset group of keys (which are modelled after specific countries). Displayed keys can be adjusted by level (basic or advanced) and typology (general, supply, demand, etc.). The "populate" buttons affect all keys, even the ones that are not visible or not part of the preset group.') 
 
     # Create a preset selection menu in the sidebar
-    preset_files = [f.replace('.csv', '') for f in os.listdir('presets') if f.endswith('.csv')]
+    preset_files = loaders.list_presets()
     selected_preset = st.sidebar.selectbox('Select a preset group of keys:', preset_files)
 
     # Load the selected preset keys and categories
-    preset_keys = load_preset(selected_preset)
-    categories = load_categories(selected_preset)
+    with profiler.section('csv_loading'):
+        preset_keys = load_preset(selected_preset)
+        categories = load_categories(selected_preset)
+
+    # Index the preset keys once per preset instead of scanning keys.csv on every rerun
+    with profiler.section('category_loop'):
+        key_index = build_key_index(keys, translations, preset_keys, categories)
+
+    # Drafts are saved per name and preset, so a restart, a refresh or a preset switch does not lose inputs
+    save_drafts = st.sidebar.checkbox('Save Draft Automatically', value=True)
+    if 'draft_owner' not in st.session_state:
+        st.session_state['draft_owner'] = draft_name_from_url()
+        # Each browser without a draft name in its URL starts a new draft, so unused drafts are deleted once per session
+        drafts.prune_drafts()
+    draft_owner = st.sidebar.text_input('Draft Name', key='draft_owner').strip() or draft_name_from_url()
+    st.query_params['draft'] = draft_owner
+    if save_drafts:
+        restore_draft(draft_owner, selected_preset, keys)
 
     # Ensure keys not in the selected preset are set to "0"
-    for key in keys:
-        if key not in preset_keys and st.session_state[key] == "":
-            st.session_state[key] = "0"
+    generator.fill_non_preset(st.session_state, key_index)
 
     # Display the flag and title for the selected preset group
     col1, col2 = st.columns([1, 9])
@@ -215,171 +403,203 @@ elif menu == "Dataset Generation":
     # Button to populate empty inputs with default advanced values in the sidebar
     populate_advanced_defaults_button = st.sidebar.button('Populate Empty Advanced Keys with Default')
 
+    # Import key values from an existing data.csv, a migration folder or a spreadsheet
+    with st.sidebar.expander('Import Values'):
+        import_file = st.file_uploader('Upload a data.csv or spreadsheet', type=['csv', 'xlsx', 'xlsm'])
+        import_path = st.text_input('Or enter a data.csv or migration folder path')
+        import_geo_id = st.text_input('geo_id to import (first dataset if empty)')
+        import_only_empty = st.checkbox('Only Fill Empty Keys')
+        import_button = st.button('Import Values')
+
     # Button to generate dataset in the sidebar
     generate_button = st.sidebar.button('Generate Dataset')
 
+    # Output mode: overwrite data.csv, or keep one row per geo_id and replace the current one
+    output_mode = st.sidebar.radio('Output Mode', ('Overwrite data.csv', 'Merge into data.csv by geo_id'))
+
+    # commits.yml can list only the keys changed since the existing data.csv instead of all columns
+    incremental_commits = st.sidebar.checkbox('List Only Changed Keys in commits.yml')
+
+    # Values are checked for missing or non-numeric entries, ranges and share sums before writing
+    validate_values = st.sidebar.checkbox('Validate Values Before Generating', value=True)
+
+    # Rendering mode: all sections at once, or only the selected section one page at a time
+    render_mode = st.sidebar.radio('Rendering Mode', ('All Sections', 'Selected Section'), key='render_mode')
+
+    # Completion pie charts can be turned off to skip loading matplotlib
+    show_charts = st.sidebar.checkbox('Show Completion Charts', value=True)
+
+    # Batch entry groups each section's inputs in a form, so edits only rerun the page when saved
+    batch_mode = st.sidebar.checkbox('Batch Entry (Save Each Section)')
+
+    with profiler.section('category_loop'):
+        sections = list_sections(key_index)
+    visible_sections = [section for section in sections if section[3]]
+    if render_mode == 'Selected Section' and visible_sections:
+        section_labels = [section[0] for section in visible_sections]
+        selected_section = st.sidebar.selectbox('Select a section:', section_labels)
+        current_section = visible_sections[section_labels.index(selected_section)]
+        section_entries = current_section[3]
+        page_size = st.sidebar.number_input('Keys per Page', min_value=10, max_value=500, value=50, step=10)
+        page_count = max(1, -(-len(section_entries) // page_size))
+        page = st.sidebar.number_input(f'Page (of {page_count})', min_value=1, max_value=page_count, value=1) if page_count > 1 else 1
+
     # Load default file for the selected preset
-    default_file = get_default_file(selected_preset)
-    if default_file:
-        defaults = load_defaults(default_file)
-    else:
-        defaults = {}
+    with profiler.section('csv_loading'):
+        default_file = get_default_file(selected_preset)
+        if default_file:
+            defaults = load_defaults(default_file)
+        else:
+            defaults = {}
+
+    # Update session state with the imported values before widgets are created
+    if import_button:
+        if import_file is not None:
+            import_values(import_file, import_file.name, import_geo_id, import_only_empty, keys, translations)
+        elif import_path:
+            import_values(import_path, None, import_geo_id, import_only_empty, keys, translations)
+        else:
+            st.sidebar.error("Please upload a file or enter a path to import.")
 
     # Update session state with default values for basic keys if the button is clicked
     if populate_basic_defaults_button:
-        for key in preset_keys:
-            if categories and key in categories['keys']:
-                idx = categories['keys'].index(key)
-                level = categories['level'][idx]
-                if level == 'Basic' and st.session_state[key] == "":
-                    st.session_state[key] = str(defaults.get(key, ""))
+        generator.fill_defaults(st.session_state, key_index, 'Basic', defaults)
 
     # Update session state with default values for advanced keys if the button is clicked
     if populate_advanced_defaults_button:
-        for key in preset_keys:
-            if categories and key in categories['keys']:
-                idx = categories['keys'].index(key)
-                level = categories['level'][idx]
-                if level == 'Advanced' and st.session_state[key] == "":
-                    st.session_state[key] = str(defaults.get(key, ""))
+        generator.fill_defaults(st.session_state, key_index, 'Advanced', defaults)
 
     # Update session state before widgets are created
     if populate_button:
-        for key in preset_keys:
-            if key not in st.session_state or st.session_state[key] == "":
-                st.session_state[key] = "0"
+        generator.fill_zero(st.session_state, key_index)
         # Increasing the delay to ensure the session state is fully updated
         time.sleep(0.5)
 
-    user_input = {}
-    total_preset_keys = len(preset_keys)
-    completed_keys = 0
-    completed_basic_keys = 0
-    completed_advanced_keys = 0
-    basic_keys = 0
-    advanced_keys = 0
-    keys_not_visible = []
-    preset_keys_not_visible = []
-
-    key_index = 1
-    visible_key_index = 1
-
-    for typology in ['General', 'Supply', 'Demand', 'Emissions', 'Conversion', 'Network', 'Heat']:
-        with st.expander(typology):
-            for key, translation in zip(keys, translations):
-                if key in preset_keys:
-                    if categories and key in categories['keys']:
-                        idx = categories['keys'].index(key)
-                        level = categories['level'][idx]
-                        key_typology = categories['typology'][idx]
-
-                        value_inserted = st.session_state[key] != ""
-
-                        if level == 'Basic' and key_typology == typology:
-                            value = st.session_state[key]
-                            user_input[key] = st.text_input(f"Enter value for {translation} ({key})", value=value, key=key)
-                            if value != "":
-                                completed_keys += 1
-                                completed_basic_keys += 1
-                            if debug_mode:
-                                st.write(f"#: {key_index}, Visible#: {visible_key_index}, Key: {key}, Level: {level}, Typology: {key_typology}, Show: True, Value: {value_inserted}, Session State: {st.session_state[key]}")
-                            visible_key_index += 1
-                            basic_keys += 1
-                        else:
-                            user_input[key] = st.session_state[key]
-                            preset_keys_not_visible.append(key)
-                            if debug_mode:
-                                st.write(f"#: {key_index}, Visible#: N/A, Key: {key}, Level: {level}, Typology: {key_typology}, Show: False, Value: {value_inserted}, Session State: {st.session_state[key]}")
-                    else:
-                        value = st.session_state[key]
-                        user_input[key] = st.text_input(f"Enter value for {translation} ({key})", value=value, key=key)
-                        if value != "":
-                            completed_keys += 1
-                        if debug_mode:
-                            st.write(f"#: {key_index}, Visible#: {visible_key_index}, Key: {key}, Level: N/A, Typology: N/A, Show: True, Value: {value_inserted}, Session State: {st.session_state[key]}")
-                        visible_key_index += 1
-                else:
-                    user_input[key] = st.session_state.get(key, "0")
-                    keys_not_visible.append(key)
-
-                key_index += 1
-
-    with st.expander("Advanced"):
-        for typology in ['General', 'Supply', 'Demand', 'Emissions', 'Conversion', 'Network', 'Heat']:
-            st.subheader(typology)
-            for key, translation in zip(keys, translations):
-                if key in preset_keys:
-                    if categories and key in categories['keys']:
-                        idx = categories['keys'].index(key)
-                        level = categories['level'][idx]
-                        key_typology = categories['typology'][idx]
-
-                        value_inserted = st.session_state[key] != ""
-
-                        if level == 'Advanced' and key_typology == typology:
-                            value = st.session_state[key]
-                            user_input[key] = st.text_input(f"Enter value for {translation} ({key})", value=value, key=key)
-                            if value != "":
-                                completed_keys += 1
-                                completed_advanced_keys += 1
-                            if debug_mode:
-                                st.write(f"#: {key_index}, Visible#: {visible_key_index}, Key: {key}, Level: {level}, Typology: {key_typology}, Show: True, Value: {value_inserted}, Session State: {st.session_state[key]}")
-                            visible_key_index += 1
-                            advanced_keys += 1
-                        else:
-                            user_input[key] = st.session_state[key]
-                            preset_keys_not_visible.append(key)
-                            if debug_mode:
-                                st.write(f"#: {key_index}, Visible#: N/A, Key: {key}, Level: {level}, Typology: {key_typology}, Show: False, Value: {value_inserted}, Session State: {st.session_state[key]}")
-                    else:
-                        value = st.session_state[key]
-                        user_input[key] = st.text_input(f"Enter value for {translation} ({key})", value=value, key=key)
-                        if value != "":
-                            completed_keys += 1
-                        if debug_mode:
-                            st.write(f"#: {key_index}, Visible#: {visible_key_index}, Key: {key}, Level: N/A, Typology: N/A, Show: True, Value: {value_inserted}, Session State: {st.session_state[key]}")
-                        visible_key_index += 1
-                else:
-                    user_input[key] = st.session_state.get(key, "0")
-                    keys_not_visible.append(key)
-
-                key_index += 1
+    # Save the keys changed by this run (edits, populate buttons) before the widgets are built
+    if save_drafts:
+        save_draft(keys, set(key_index['non_preset']))
+
+    with profiler.section('category_loop'):
+        # Completion counts are recounted in full on every run, except in batch entry mode where
+        # they are only recounted for a new preset, a restored draft or a populate button, and per section when a form is saved
+        if (not batch_mode or st.session_state.get('completion_preset') != selected_preset
+                or st.session_state.pop('completion_stale', False)
+                or populate_button or populate_basic_defaults_button or populate_advanced_defaults_button):
+            refresh_completion(sections)
+            st.session_state['completion_preset'] = selected_preset
+        section_completion = st.session_state['section_completion']
+
+        # Hidden keys keep their session state value; rendered keys are overwritten by their widget
+        user_input = {key: st.session_state.get(key, "0") for key in keys}
+        total_preset_keys = len(preset_keys)
+        basic_keys = sum(len(section[3]) for section in sections if section[1] == 'Basic')
+        advanced_keys = sum(len(section[3]) for section in sections if section[1] == 'Advanced')
+        completed_basic_keys = sum(section_completion[section[0]] for section in sections if section[1] == 'Basic')
+        completed_advanced_keys = sum(section_completion[section[0]] for section in sections if section[1] == 'Advanced')
+        completed_keys = sum(section_completion[section[0]] for section in sections)
+
+    with profiler.section('widget_creation'):
+        if render_mode == 'Selected Section' and visible_sections:
+            # Only the widgets of the current page are built; the other keys stay in the session state
+            st.subheader(selected_section)
+            profiler.count('elements')
+            page_entries = section_entries[(page - 1) * page_size:page * page_size]
+            render_section(current_section, page_entries, user_input, batch_mode, sections)
+        else:
+            basic_sections = [section for section in sections if section[1] == 'Basic']
+            advanced_sections = [section for section in sections if section[1] == 'Advanced']
+            for section in basic_sections:
+                profiler.count('containers')
+                with st.expander(section[2]):
+                    render_section(section, section[3], user_input, batch_mode, sections)
+                    if section is basic_sections[0]:
+                        # Preset keys without a category are shown once, in the first section
+                        render_section(sections[-1], sections[-1][3], user_input, batch_mode, sections)
+
+            profiler.count('containers')
+            with st.expander("Advanced"):
+                for section in advanced_sections:
+                    st.subheader(section[2])
+                    profiler.count('elements')
+                    render_section(section, section[3], user_input, batch_mode, sections)
 
     progress_percentage = int((completed_keys / total_preset_keys) * 100)
     basic_completion_percentage = int((completed_basic_keys / basic_keys) * 100) if basic_keys > 0 else 0
     advanced_completion_percentage = int((completed_advanced_keys / advanced_keys) * 100) if advanced_keys > 0 else 0
 
     # Display the progress pie charts just below the title
-    with pie_placeholder_col1:
-        st.pyplot(create_pie_chart(basic_completion_percentage, 'Basic Keys Completion'))
-    with pie_placeholder_col2:
-        st.pyplot(create_pie_chart(advanced_completion_percentage, 'Advanced Keys Completion'))
+    if show_charts:
+        with profiler.section('chart_rendering'):
+            with pie_placeholder_col1:
+                st.image(create_pie_chart(basic_completion_percentage, 'Basic Keys Completion'))
+            with pie_placeholder_col2:
+                st.image(create_pie_chart(advanced_completion_percentage, 'Advanced Keys Completion'))
+            profiler.count('elements', 2)
 
     # Show progress bar and numerical percentage below the 'Data Entry Form' title
     progress_placeholder_text.write(f"Completion: {progress_percentage}% ({completed_keys}/{total_preset_keys})")
     progress_placeholder_bar.progress(progress_percentage)
 
     if debug_mode:
-        if keys_not_visible:
-            st.write("Keys from keys.csv not currently visible:")
-            for i, key in enumerate(keys_not_visible, start=1):
-                st.write(f"#: {i}, Key: {key}")
-        if preset_keys_not_visible:
-            st.write("Keys from the selected preset group not currently visible:")
-            for i, key in enumerate(preset_keys_not_visible, start=1):
-                st.write(f"#: {i}, Key: {key}")
-
-    if generate_button:
-        new_df = pd.DataFrame([user_input])
-        output_file_path = 'output/data.csv'
-        new_df.to_csv(output_file_path, index=False)
-        st.success("data.csv generated successfully")
-        st.download_button(
-            label="Download CSV",
-            data=new_df.to_csv(index=False),
-            file_name='data.csv',
-            mime='text/csv'
-        )
+        with st.sidebar.expander(f"Keys not shown: {len(key_index['non_preset'])} outside the preset, {len(key_index['hidden'])} without a known category"):
+            st.write(", ".join(key_index['non_preset'] + key_index['hidden']))
+
+    violations = validation.validate_row(user_input) if generate_button and validate_values else []
+    if violations:
+        st.error(f"{len(violations)} values failed validation, data.csv was not written. Fix them or turn off validation in the sidebar.")
+        st.dataframe([{'Key': key, 'Value': value, 'Problem': problem} for key, value, problem in violations])
+    elif generate_button:
+        merge = output_mode != 'Overwrite data.csv'
+        changes = dataset_changes(user_input, merge)
+        if merge:
+            up_to_date = changes == {}
+        else:
+            # Overwriting must also drop any other rows, so compare the whole file
+            up_to_date = False
+            if changes == {}:
+                with open(generator.OUTPUT_PATH, newline='', encoding='utf-8') as file:
+                    up_to_date = file.read() == generator.dataset_to_csv(user_input)
+
+        with profiler.section('file_writes'):
+            written = up_to_date
+            if up_to_date:
+                st.info("data.csv already holds these values, nothing was written")
+            else:
+                try:
+                    if merge:
+                        # Rows are matched on geo_id, so an empty or missing geo_id is rejected
+                        generator.upsert_dataset(user_input)
+                        st.success(f"Row for geo_id '{user_input['geo_id']}' merged into data.csv successfully")
+                    else:
+                        generator.write_dataset(user_input)
+                        st.success("data.csv generated successfully")
+                except ValueError as e:
+                    st.error(f"Failed to write data.csv: {e}")
+                else:
+                    written = True
+                    remember_written(user_input, merge)
+                    if changes:
+                        with st.expander(f"Keys changed since the previous data.csv: {len(changes)}"):
+                            st.dataframe([{'Key': key, 'Previous': old, 'New': new} for key, (old, new) in changes.items()])
+
+            # The changed keys are added to those changed since commits.yml was last copied into a migration,
+            # and a geo_id without a previous row needs every column
+            if written and not (up_to_date and incremental_commits):
+                generator.write_generation_commits(changes, incremental_commits)
+
+        if written:
+            # A merged data.csv holds the rows of every geo_id, so the whole file is served
+            if merge:
+                with open(generator.OUTPUT_PATH, newline='', encoding='utf-8') as file:
+                    csv_data = file.read()
+            else:
+                csv_data = generator.dataset_to_csv(user_input)
+            st.download_button(
+                label="Download CSV",
+                data=csv_data,
+                file_name='data.csv',
+                mime='text/csv'
+            )
         st.session_state['dataset_generated'] = True
 
 elif menu == "Dataset Migration":
@@ -388,7 +608,11 @@ elif menu == "Dataset Migration":
 
     # Display the most recent migration folder
     if st.button('Fetch Most Recent Migration'):
-        most_recent_migration = get_most_recent_migration()
+        try:
+            most_recent_migration = migration.get_most_recent_migration()
+        except FileNotFoundError:
+            most_recent_migration = None
+            st.error("etlocal/db/migrate not found. Please ensure etlocal is next to the ethelper directory.")
         if most_recent_migration:
             st.write(f"Most recent migration: {most_recent_migration}")
         else:
@@ -397,17 +621,37 @@ elif menu == "Dataset Migration":
     # Text input for the migration name
     migration_name = st.text_input("Enter the migration name:")
 
+    # Values of every data.csv row are checked before they reach etlocal
+    validate_migration = st.checkbox('Validate data.csv Before Updating', value=True)
+
     if st.button('Update Migration'):
-        if migration_name:
-            base_path = os.path.abspath(os.path.join(os.getcwd(), '..'))
-            destination_dir = os.path.join(base_path, 'etlocal', 'db', 'migrate', migration_name)
+        violations = []
+        if validate_migration and os.path.exists(generator.OUTPUT_PATH):
+            violations = validation.validate_file(generator.OUTPUT_PATH)
+        if violations:
+            st.error(f"{len(violations)} values in data.csv failed validation, the migration was not updated.")
+            st.dataframe([{'Row': row + 1, 'Key': key, 'Value': value, 'Problem': problem} for row, key, value, problem in violations])
+        elif migration_name:
+            destination_dir = os.path.join(migration.MIGRATE_PATH, migration_name)
             if not os.path.exists(destination_dir):
                 os.makedirs(destination_dir)
             try:
-                shutil.copy('output/data.csv', destination_dir)
-                shutil.copy('output/commits.yml', os.path.join(destination_dir, 'commits.yml'))
-                update_rb_file(migration_name)
-                st.success(f"data.csv, commits.yml, and {migration_name}.rb updated successfully")
+                # Files whose content is already in the migration are not copied again
+                with profiler.section('file_writes'):
+                    # Copying into the same migration again keeps the fields it already commits
+                    generator.merge_migration_commits(migration_name, os.path.join(destination_dir, 'commits.yml'))
+                    copied = [
+                        name for name in ('data.csv', 'commits.yml')
+                        if migration.copy_if_changed(os.path.join('output', name), os.path.join(destination_dir, name))
+                    ]
+                    rb_updated = migration.update_rb_file(migration_name)
+                    # The fields listed so far are in the migration now, later generations start a new list
+                    generator.mark_commits_migrated(migration_name)
+                updated = copied + ([f"{migration_name}.rb"] if rb_updated else [])
+                if updated:
+                    st.success(f"{', '.join(updated)} updated successfully")
+                else:
+                    st.success(f"data.csv, commits.yml, and {migration_name}.rb are already up to date")
             except Exception as e:
                 st.error(f"Failed to update migration: {e}")
         else:
@@ -416,11 +660,117 @@ elif menu == "Dataset Migration":
 elif menu == "Dataset Visualisation":
     st.title('Dataset Visualisation')
 
+    # data.csv is parsed once and cached until it changes; errors do not stop the script, so the rerun profile is still shown
     try:
-        data_df = pd.read_csv('output/data.csv')
-        st.write("Current content of data.csv:")
-        st.dataframe(data_df.astype(str).transpose())
+        dataset = loaders.load_dataset(generator.OUTPUT_PATH)
     except FileNotFoundError:
+        dataset = None
         st.error("output/data.csv not found. Please generate the dataset first.")
-    except pd.errors.EmptyDataError:
+    if dataset is not None and (not dataset['header'] or not dataset['rows']):
+        dataset = None
         st.error("output/data.csv is empty.")
+
+    if dataset is not None:
+        # Categories of the selected preset are shown next to each key
+        selected_preset = st.sidebar.selectbox('Select a preset group of keys:', loaders.list_presets())
+        categories = load_categories(selected_preset)
+        key_set = set(keys)
+        extra_keys = tuple(key for key in dataset['header'] if key not in key_set)
+        grid_rows, search_index = build_grid(keys, translations, categories, extra_keys)
+
+        # Select the data.csv row to show, by geo_id when the file holds several datasets
+        header = dataset['header']
+        geo_position = header.index('geo_id') if 'geo_id' in header else None
+        row_labels = [row[geo_position] if geo_position is not None and geo_position < len(row) else f"Row {i + 1}" for i, row in enumerate(dataset['rows'])]
+        selected_row = st.sidebar.selectbox('Select a dataset (geo_id):', range(len(row_labels)), format_func=lambda i: row_labels[i])
+        file_values = dict(zip(header, dataset['rows'][selected_row]))
+
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            query = st.text_input("Search keys, translations and categories:")
+        with col2:
+            search_mode = st.radio("Match", ('Substring', 'Prefix'), horizontal=True)
+        matches = search.search(search_index, query, search_mode.lower())
+
+        # Only the rows of the current page are sent to the browser
+        page_size = st.sidebar.selectbox('Rows per Page', (25, 50, 100, 200), index=1)
+        page_count = max(1, -(-len(matches) // page_size))
+        page = st.sidebar.number_input(f'Page (of {page_count})', min_value=1, max_value=page_count, value=1) if page_count > 1 else 1
+        page_rows = [grid_rows[i] for i in matches[(page - 1) * page_size:page * page_size]]
+        st.write(f"{len(matches)} of {len(grid_rows)} keys match. Values in the Session Value column can be edited and are shared with the Dataset Generation form.")
+
+        # Columns of data.csv that are not in keys.csv have no session value, so they are shown read-only
+        key_rows = [row for row in page_rows if row[0] in key_set]
+        extra_rows = [row for row in page_rows if row[0] not in key_set]
+
+        grid_df = pd.DataFrame({
+            'Key': [row[0] for row in key_rows],
+            'Translation': [row[1] for row in key_rows],
+            'Level': [row[2] for row in key_rows],
+            'Typology': [row[3] for row in key_rows],
+            'data.csv Value': [file_values.get(row[0], '') for row in key_rows],
+            'Session Value': [st.session_state.get(row[0], '') for row in key_rows]
+        })
+        edited_df = st.data_editor(
+            grid_df,
+            disabled=['Key', 'Translation', 'Level', 'Typology', 'data.csv Value'],
+            hide_index=True,
+            key=f'grid_{selected_row}_{page}_{search_mode}_{query}'
+        )
+        profiler.count('widgets')
+        profiler.count('elements')
+        if extra_rows:
+            st.write("Columns of data.csv not in keys.csv (read-only):")
+            st.dataframe([{'Key': row[0], 'data.csv Value': file_values.get(row[0], '')} for row in extra_rows], hide_index=True)
+            profiler.count('elements')
+
+        # Write edited values back into the session values used by the Dataset Generation form
+        grid_changes = {}
+        for key, old_value, new_value in zip(grid_df['Key'], grid_df['Session Value'], edited_df['Session Value']):
+            if new_value != old_value:
+                grid_changes[key] = '' if new_value is None else str(new_value)
+        if grid_changes:
+            st.session_state.update(grid_changes)
+            # Completion counts are recounted on the Dataset Generation page, also in batch entry mode
+            st.session_state['completion_stale'] = True
+            # Edits are saved into the current draft right away, so a restart before the form runs again keeps them
+            if st.session_state.get('draft_id'):
+                owner, preset = st.session_state['draft_id']
+                drafts.save_changes(owner, preset, grid_changes)
+                st.session_state['draft_snapshot'].update(grid_changes)
+
+elif menu == "Local Testing":
+    st.title('Local Testing')
+    st.write("Starts etengine and etmodel side by side and waits until both answer. Images are only rebuilt when their build files changed, and the dataset is only reloaded when data.csv or the migration changed since the last start.")
+
+    try:
+        default_migration = migration.get_most_recent_migration() or ''
+    except FileNotFoundError:
+        default_migration = ''
+    migration_name = st.text_input("Migration to load (leave empty to start without a dataset):", value=default_migration)
+    use_stub = st.checkbox('Use Offline Stub Engine (without Docker)')
+    force_rebuild = st.checkbox('Rebuild Images and Reload Dataset')
+    engine = localstack.get_engine(use_stub)
+
+    start_col, stop_col = st.columns(2)
+    if start_col.button('Start Local ETM'):
+        with st.spinner('Starting etengine and etmodel...'):
+            try:
+                steps = localstack.start_stack(engine, migration_name or None, force=force_rebuild)
+                st.success("Local ETM running")
+                st.dataframe([{'Step': step, 'Result': outcome, 'Seconds': round(seconds, 1)} for step, outcome, seconds in steps], hide_index=True)
+            except Exception as e:
+                st.error(f"Failed to start the local ETM: {e}")
+    if stop_col.button('Stop Local ETM'):
+        try:
+            localstack.stop_stack(engine)
+            st.success("Local ETM stopped")
+        except Exception as e:
+            st.error(f"Failed to stop the local ETM: {e}")
+
+    st.subheader('Status')
+    st.dataframe([{'Service': name, 'URL': url, 'Running': healthy} for name, url, healthy in localstack.stack_status()], hide_index=True)
+
+# Show the timing breakdown of this rerun once every element has been created
+if debug_mode:
+    show_profile(menu, export_profile)
@@ -0,0 +1,367 @@
+import argparse
+import csv
+import hashlib
+import io
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+
+import loaders
+import validation
+
+# Typologies and levels used to group keys in the Data Entry Form
+TYPOLOGIES = ['General', 'Supply', 'Demand', 'Emissions', 'Conversion', 'Network', 'Heat']
+LEVELS = ['Basic', 'Advanced']
+
+OUTPUT_PATH = os.path.join('output', 'data.csv')
+COMMITS_PATH = os.path.join('output', 'commits.yml')
+# Hash of the commits.yml last copied into a migration, after which no fields are pending
+COMMITS_MIGRATED_PATH = os.path.join('output', 'commits.migrated')
+
+
+# Function to index the keys of a preset by level and typology, keeping the keys.csv order
+def build_key_index(keys, translations, preset_keys, categories):
+    preset_key_set = set(preset_keys)
+    category_lookup = {}
+    if categories:
+        for key, level, typology in zip(categories['keys'], categories['level'], categories['typology']):
+            category_lookup.setdefault(key, (level, typology))
+
+    sections = {(level, typology): [] for level in LEVELS for typology in TYPOLOGIES}
+    uncategorised = []
+    non_preset = []
+    for key, translation in zip(keys, translations):
+        if key not in preset_key_set:
+            non_preset.append(key)
+        elif key in category_lookup:
+            level, typology = category_lookup[key]
+            sections.setdefault((level, typology), []).append((key, translation, level))
+        else:
+            uncategorised.append((key, translation, 'N/A'))
+
+    hidden = [
+        key
+        for (level, typology), entries in sections.items()
+        if level not in LEVELS or typology not in TYPOLOGIES
+        for key, _, _ in entries
+    ]
+    return {'sections': sections, 'uncategorised': uncategorised, 'non_preset': non_preset, 'hidden': hidden}
+
+
+# Function to list the (key, translation, level) entries of a preset, optionally for a single level
+def preset_entries(key_index, level=None):
+    for (entry_level, _), entries in key_index['sections'].items():
+        if level is None or entry_level == level:
+            yield from entries
+    if level is None:
+        yield from key_index['uncategorised']
+
+
+# Function to set empty keys that are not part of the preset to "0"
+def fill_non_preset(values, key_index):
+    for key in key_index['non_preset']:
+        if values[key] == "":
+            values[key] = "0"
+
+
+# Function to populate empty keys of a level with their default values
+def fill_defaults(values, key_index, level, defaults):
+    for key, _, _ in preset_entries(key_index, level):
+        if values[key] == "":
+            values[key] = str(defaults.get(key, ""))
+
+
+# Function to populate empty preset keys with "0"
+def fill_zero(values, key_index):
+    for key, _, _ in preset_entries(key_index):
+        if values[key] == "":
+            values[key] = "0"
+
+
+# Function to build a data.csv row from input values, applying the same rules as the Data Entry Form
+# populate is a collection of 'basic', 'advanced' and 'zero', applied in that order
+def build_dataset(keys, translations, preset_keys, categories, defaults, values=None, populate=()):
+    key_index = build_key_index(keys, translations, preset_keys, categories)
+    row = {key: str(values.get(key, "")) if values else "" for key in keys}
+    fill_non_preset(row, key_index)
+    if 'basic' in populate:
+        fill_defaults(row, key_index, 'Basic', defaults)
+    if 'advanced' in populate:
+        fill_defaults(row, key_index, 'Advanced', defaults)
+    if 'zero' in populate:
+        fill_zero(row, key_index)
+    return row
+
+
+# Function to read input values from a CSV file with a row of keys followed by a row of values
+def read_values(path):
+    with open(path, newline='', encoding='utf-8-sig') as file:
+        rows = csv.reader(file)
+        header = next(rows, [])
+        values = next(rows, [])
+    return dict(zip(header, values))
+
+
+# Function to convert a data.csv row to CSV text
+def dataset_to_csv(row):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(row.keys())
+    writer.writerow(row.values())
+    return buffer.getvalue()
+
+
+# Function to open a temporary file next to path that replaces it only once fully written
+@contextmanager
+def atomic_write(path):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix=os.path.basename(path))
+    try:
+        with os.fdopen(fd, 'w', newline='', encoding='utf-8') as file:
+            yield file
+        # mkstemp creates the file as owner-only, keep the permissions of the file being replaced
+        os.chmod(temp_path, os.stat(path).st_mode & 0o777 if os.path.exists(path) else 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+# Function to write a data.csv row to a file
+def write_dataset(row, path=OUTPUT_PATH):
+    with atomic_write(path) as file:
+        file.write(dataset_to_csv(row))
+
+
+# Function to insert or replace rows of a multi-row data.csv, matched on geo_id
+# The existing rows are streamed, so memory only grows with the rows being written
+def upsert_datasets(rows, path=OUTPUT_PATH, key_column='geo_id'):
+    new_rows = {}
+    for row in rows:
+        if not str(row.get(key_column, '')).strip():
+            raise ValueError(f"Every row needs a '{key_column}' value to be merged")
+        new_rows[row[key_column]] = row
+
+    reader_file = open(path, newline='', encoding='utf-8-sig') if os.path.exists(path) else None
+    try:
+        records = csv.reader(reader_file) if reader_file else iter(())
+        header = next(records, [])
+        if header and key_column not in header:
+            raise ValueError(f"{path} has no '{key_column}' column")
+        columns = set(header)
+        for row in new_rows.values():
+            for key in row:
+                if key not in columns:
+                    header.append(key)
+                    columns.add(key)
+        key_position = header.index(key_column)
+
+        with atomic_write(path) as file:
+            writer = csv.writer(file, lineterminator='\n')
+            writer.writerow(header)
+            for record in records:
+                record += [""] * (len(header) - len(record))
+                row = new_rows.pop(record[key_position], None)
+                if row is not None:
+                    record = [row.get(key, value) for key, value in zip(header, record)]
+                writer.writerow(record)
+            for row in new_rows.values():
+                writer.writerow([row.get(key, "") for key in header])
+            if reader_file:
+                # Closed before the file is replaced, which Windows requires
+                reader_file.close()
+    finally:
+        if reader_file:
+            reader_file.close()
+
+
+# Function to insert or replace a single row of a multi-row data.csv, matched on geo_id
+def upsert_dataset(row, path=OUTPUT_PATH, key_column='geo_id'):
+    upsert_datasets([row], path, key_column)
+
+
+# Function to read an existing data.csv row: the one with the given geo_id, or the first one
+def read_dataset_row(path=OUTPUT_PATH, geo_id=None, key_column='geo_id'):
+    if not os.path.exists(path):
+        return None
+    with open(path, newline='', encoding='utf-8-sig') as file:
+        records = csv.reader(file)
+        header = next(records, [])
+        if geo_id is None:
+            record = next(records, None)
+            return dict(zip(header, record)) if record is not None else None
+        if key_column not in header:
+            return None
+        key_position = header.index(key_column)
+        for record in records:
+            if len(record) > key_position and record[key_position] == geo_id:
+                return dict(zip(header, record))
+    return None
+
+
+# Function to list the keys whose value differs between two rows, as {key: (old value, new value)}
+def diff_rows(old_row, new_row):
+    return {key: (old_row.get(key), value) for key, value in new_row.items() if old_row.get(key) != value}
+
+
+# Function to build the text of a commits.yml, committing all CSV columns or only the given fields
+def commits_yml(fields=None):
+    if fields is None:
+        return "---\n- fields:\n  - :all\n  message:\n    Every CSV column will be used in this commit.\n"
+    lines = ["---", "- fields:"]
+    lines += [f"  - {field}" for field in fields]
+    lines += ["  message:", "    Only the changed CSV columns will be used in this commit."]
+    return "\n".join(lines) + "\n"
+
+
+# Function to write a commits.yml next to data.csv
+def write_commits(fields=None, path=COMMITS_PATH):
+    with atomic_write(path) as file:
+        file.write(commits_yml(fields))
+
+
+# Function to get the fields of a commits.yml's text, or None when it commits every column
+def read_commit_fields(text):
+    fields = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line == '- :all':
+            return None
+        if line.startswith('- ') and line != '- fields:':
+            fields.append(line[2:])
+    return fields
+
+
+# Function to read the hash of the commits.yml last copied into a migration and the name of that migration,
+# as (hash, migration name), either being None when unknown
+def read_commits_migrated(migrated_path=COMMITS_MIGRATED_PATH):
+    if not os.path.exists(migrated_path):
+        return None, None
+    with open(migrated_path, encoding='utf-8') as file:
+        lines = [line.strip() for line in file.read().splitlines()] + ['', '']
+    return lines[0] or None, lines[1] or None
+
+
+def _write_commits_migrated(digest, migration_name, migrated_path):
+    with atomic_write(migrated_path) as file:
+        file.write(f"{digest or ''}\n{migration_name or ''}\n")
+
+
+# Function to get the fields changed since commits.yml was last copied into a migration,
+# or None when every column has to be committed (no commits.yml yet, or one committing every column)
+def pending_commit_fields(path=COMMITS_PATH, migrated_path=COMMITS_MIGRATED_PATH):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as file:
+        content = file.read()
+    if read_commits_migrated(migrated_path)[0] == hashlib.sha256(content).hexdigest():
+        return []
+    return read_commit_fields(content.decode('utf-8'))
+
+
+# Function to add changed fields to the fields pending migration, None (every column) meaning a new row
+def merge_commit_fields(pending, changed):
+    if pending is None or changed is None:
+        return None
+    # An empty list would commit nothing, every column is committed instead
+    return list(dict.fromkeys([*pending, *changed])) or None
+
+
+# Function to write the commits.yml of a generation: every column, or (incremental) the changed fields
+# added to those changed since commits.yml was last copied into a migration
+def write_generation_commits(changed, incremental=True, path=COMMITS_PATH, migrated_path=COMMITS_MIGRATED_PATH):
+    fields = merge_commit_fields(pending_commit_fields(path, migrated_path), changed) if incremental else None
+    write_commits(fields, path)
+    # The new fields are not in a migration yet, only the name of the last migration is kept
+    migration_name = read_commits_migrated(migrated_path)[1]
+    if migration_name:
+        _write_commits_migrated(None, migration_name, migrated_path)
+    elif os.path.exists(migrated_path):
+        os.remove(migrated_path)
+
+
+# Function to add the fields of a migration's commits.yml to commits.yml before copying it there again
+# A migration that has not been run yet still needs the fields copied into it before, as its data.csv is replaced
+# in full; when commits.yml was last copied into another migration, the fields listed since then are copied as they are
+# Returns whether commits.yml was changed
+def merge_migration_commits(migration_name, destination, path=COMMITS_PATH, migrated_path=COMMITS_MIGRATED_PATH):
+    if read_commits_migrated(migrated_path)[1] != migration_name:
+        return False
+    if not os.path.exists(path) or not os.path.exists(destination):
+        return False
+    with open(destination, encoding='utf-8') as file:
+        copied = read_commit_fields(file.read())
+    with open(path, encoding='utf-8') as file:
+        pending = read_commit_fields(file.read())
+    fields = merge_commit_fields(copied, pending)
+    if fields == pending:
+        return False
+    write_commits(fields, path)
+    return True
+
+
+# Function to record that commits.yml was copied into a migration, so the next generation starts a new field list
+def mark_commits_migrated(migration_name, path=COMMITS_PATH, migrated_path=COMMITS_MIGRATED_PATH):
+    with open(path, 'rb') as file:
+        digest = hashlib.sha256(file.read()).hexdigest()
+    _write_commits_migrated(digest, migration_name, migrated_path)
+
+
+# Function to generate the dataset of a preset from the shared keys, translations and preset files
+def generate(preset_name, values=None, default_file=None, populate=()):
+    keys = loaders.load_keys()
+    translations = loaders.load_translations()
+    preset_keys = loaders.load_preset(preset_name)
+    categories = loaders.load_categories(preset_name)
+    if default_file is None:
+        default_file = loaders.load_default_list().get(preset_name)
+    defaults = loaders.load_defaults(default_file) if default_file and populate else {}
+    return build_dataset(keys, translations, preset_keys, categories, defaults, values, populate)
+
+
+# Function to parse the command-line arguments
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Generate data.csv for the ETM without the Streamlit interface.')
+    parser.add_argument('preset', help='preset group of keys, e.g. Vanuatu')
+    parser.add_argument('--values', help='CSV file with a row of keys and a row of values')
+    parser.add_argument('--defaults', help='default file in presets/defaults (defaults to the one in config/defaultlist.csv)')
+    parser.add_argument('--populate', nargs='*', default=[], choices=['basic', 'advanced', 'zero'],
+                        help='populate empty keys with basic defaults, advanced defaults and/or 0')
+    parser.add_argument('--output', default=OUTPUT_PATH, help='path of the generated data.csv')
+    parser.add_argument('--skip-validation', action='store_true',
+                        help='write data.csv even when values are missing, not numeric or out of range')
+    parser.add_argument('--merge', action='store_true',
+                        help='insert or replace the row with the same geo_id instead of overwriting the file')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        values = read_values(args.values) if args.values else None
+        row = generate(args.preset, values, args.defaults, args.populate)
+    except FileNotFoundError as e:
+        print(f"File not found: {e.filename}", file=sys.stderr)
+        return 1
+    violations = [] if args.skip_validation else validation.validate_row(row)
+    if violations:
+        for key, value, problem in violations:
+            print(f"{key} = '{value}': {problem}", file=sys.stderr)
+        print(f"{len(violations)} values failed validation, {args.output} was not written", file=sys.stderr)
+        return 1
+    try:
+        if args.merge:
+            upsert_dataset(row, args.output)
+        else:
+            write_dataset(row, args.output)
+    except ValueError as e:
+        print(f"{args.output} was not written: {e}", file=sys.stderr)
+        return 1
+    print(f"{args.output} generated successfully")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
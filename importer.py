@@ -0,0 +1,93 @@
+import csv
+import io
+import os
+from functools import lru_cache
+
+SPREADSHEET_EXTENSIONS = ('.xlsx', '.xlsm')
+
+
+# Function to normalise a column name before looking it up
+def normalise(name):
+    return str(name).strip().lstrip('\ufeff').lower()
+
+
+# Function to map column names (keys or their translations, in any case) to keys from keys.csv
+@lru_cache(maxsize=8)
+def build_column_index(keys, translations):
+    index = {}
+    for key, translation in zip(keys, translations):
+        index.setdefault(normalise(translation), key)
+    for key in keys:
+        # Keys take precedence over translations with the same name
+        index[normalise(key)] = key
+    return index
+
+
+# Function to stream the rows of a CSV file, given as a path or a binary file object
+def iter_csv_rows(source):
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, newline='', encoding='utf-8-sig') as file:
+            yield from csv.reader(file)
+    else:
+        yield from csv.reader(io.TextIOWrapper(source, encoding='utf-8-sig', newline=''))
+
+
+# Function to stream the rows of the first sheet of a spreadsheet, given as a path or a binary file object
+def iter_spreadsheet_rows(source):
+    try:
+        import openpyxl
+    except ImportError:
+        raise ImportError("Importing spreadsheets requires openpyxl: pip install openpyxl")
+    # Read-only mode streams the sheet instead of loading it whole
+    workbook = openpyxl.load_workbook(source, read_only=True, data_only=True)
+    try:
+        for row in workbook.worksheets[0].iter_rows(values_only=True):
+            yield ['' if cell is None else str(cell) for cell in row]
+    finally:
+        workbook.close()
+
+
+# Function to stream the rows of a data.csv, a migration folder (its data.csv) or a spreadsheet
+def iter_rows(source, name=None):
+    name = name or (str(source) if isinstance(source, (str, os.PathLike)) else '')
+    if isinstance(source, (str, os.PathLike)) and os.path.isdir(source):
+        return iter_csv_rows(os.path.join(source, 'data.csv'))
+    if name.lower().endswith(SPREADSHEET_EXTENSIONS):
+        return iter_spreadsheet_rows(source)
+    return iter_csv_rows(source)
+
+
+# Function to read the values of one dataset from rows laid out like data.csv (a header row of keys
+# followed by one row per dataset) or as key/value pairs (one key per row)
+# Returns ({key: value}, [unmapped columns or rows])
+def read_values(rows, column_index, geo_id=None):
+    rows = iter(rows)
+    header = next(rows, [])
+    columns = [column_index.get(normalise(name)) for name in header]
+
+    # Two columns with an unknown second name are key/value pairs, e.g. "geo_id,NH5"
+    wide = any(columns) and not (len(columns) == 2 and columns[1] is None)
+    if wide:
+        geo_position = columns.index('geo_id') if 'geo_id' in columns else None
+        for record in rows:
+            if geo_id is None or (geo_position is not None and geo_position < len(record)
+                                  and record[geo_position] == geo_id):
+                values = {key: value for key, value in zip(columns, record) if key}
+                unmapped = [name for name, key in zip(header, columns) if not key]
+                return values, unmapped
+        return {}, []
+
+    # Key/value layout: the header row is already the first pair
+    values = {}
+    unmapped = []
+    for record in [header, *rows]:
+        if len(record) < 2:
+            continue
+        key = column_index.get(normalise(record[0]))
+        if key:
+            values[key] = record[1]
+        else:
+            unmapped.append(record[0])
+    if geo_id is not None and values.get('geo_id') != geo_id:
+        return {}, []
+    return values, unmapped
@@ -0,0 +1,120 @@
+import csv
+import hashlib
+import io
+import os
+import threading
+
+KEYS_PATH = os.path.join('variables', 'keys.csv')
+TRANSLATIONS_PATH = os.path.join('variables', 'translations.csv')
+DEFAULT_LIST_PATH = os.path.join('config', 'defaultlist.csv')
+PRESETS_DIR = 'presets'
+DATASET_PATH = os.path.join('output', 'data.csv')
+
+# Parsed files shared by every rerun and session, keyed by (path, parser)
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+# Function to parse the rows of a CSV file with the csv module (tolerating a UTF-8 BOM)
+def parse_rows(content):
+    return [row for row in csv.reader(io.StringIO(content.decode('utf-8-sig'), newline=''))]
+
+
+# Function to load a file through a parser, reusing the cached result until the file's mtime and hash change
+def load_cached(path, parser):
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    cache_key = (path, parser)
+
+    with _cache_lock:
+        cached = _cache.get(cache_key)
+    if cached and cached[0] == stamp:
+        return cached[2]
+
+    with open(path, 'rb') as file:
+        content = file.read()
+    digest = hashlib.sha1(content).hexdigest()
+    if cached and cached[1] == digest:
+        # Touched but unchanged, keep the parsed value
+        value = cached[2]
+    else:
+        value = parser(parse_rows(content))
+
+    with _cache_lock:
+        _cache[cache_key] = (stamp, digest, value)
+    return value
+
+
+# Function to drop every cached file, forcing the next loads to reparse
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+
+
+def _first_row(rows):
+    return tuple(rows[0]) if rows else ()
+
+
+def _second_row(rows):
+    return tuple(rows[1]) if len(rows) > 1 else ()
+
+
+def _categories(rows):
+    if len(rows) < 3:
+        return {}
+    return {
+        'keys': tuple(rows[0]),
+        'level': tuple(level.capitalize() for level in rows[1]),
+        'typology': tuple(typology.capitalize() for typology in rows[2])
+    }
+
+
+def _mapping(rows):
+    if len(rows) < 2:
+        return {}
+    return dict(zip(rows[0], rows[1]))
+
+
+def _dataset(rows):
+    return {'header': tuple(rows[0]) if rows else (), 'rows': tuple(tuple(row) for row in rows[1:])}
+
+
+# Function to load the keys from the first row of keys.csv
+def load_keys(path=KEYS_PATH):
+    return load_cached(path, _first_row)
+
+
+# Function to load the translations from the second row of translations.csv
+def load_translations(path=TRANSLATIONS_PATH):
+    return load_cached(path, _second_row)
+
+
+# Function to load the keys of a preset
+def load_preset(preset_name, presets_dir=PRESETS_DIR):
+    return load_cached(os.path.join(presets_dir, f'{preset_name}.csv'), _first_row)
+
+
+# Function to load the keys, levels and typologies of a preset
+def load_categories(preset_name, presets_dir=PRESETS_DIR):
+    return load_cached(os.path.join(presets_dir, 'categories', preset_name, 'categories.csv'), _categories)
+
+
+# Function to load the default value of each key from a defaults file
+def load_defaults(default_file, presets_dir=PRESETS_DIR):
+    return load_cached(os.path.join(presets_dir, 'defaults', f'{default_file}.csv'), _mapping)
+
+
+# Function to load the preset to default file mapping from defaultlist.csv
+def load_default_list(path=DEFAULT_LIST_PATH):
+    return load_cached(path, _mapping)
+
+
+# Function to load a data.csv file as its header and rows
+def load_dataset(path=DATASET_PATH):
+    return load_cached(path, _dataset)
+
+
+# Function to list the available presets
+def list_presets(presets_dir=PRESETS_DIR):
+    return [f.replace('.csv', '') for f in os.listdir(presets_dir) if f.endswith('.csv')]
@@ -0,0 +1,325 @@
+import argparse
+import hashlib
+import http.server
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+import generator
+import migration
+
+ETLOCAL_PATH = os.path.join('..', 'etlocal')
+STATE_PATH = os.path.join('output', 'localstack.json')
+
+# Services of the local ETM: the folder holding their docker-compose.yml, the URL answering once they
+# are up, and the files their image is built from
+SERVICES = {
+    'etengine': {
+        'path': os.path.join('..', 'etengine'),
+        'url': 'http://localhost:3000/',
+        'build_files': ('Dockerfile', 'docker-compose.yml', 'Gemfile.lock', 'yarn.lock')
+    },
+    'etmodel': {
+        'path': os.path.join('..', 'etmodel'),
+        'url': 'http://localhost:3001/',
+        'build_files': ('Dockerfile', 'docker-compose.yml', 'Gemfile.lock', 'yarn.lock')
+    }
+}
+
+COMPOSE = ['docker', 'compose']
+# Command run in etlocal to import a migration (and so data.csv) into its database, followed by VERSION=<timestamp>
+# A redo rolls the migration back and runs it again, so an already applied migration is reloaded with its new data
+DATASET_COMMAND = ['run', '--rm', 'web', 'bundle', 'exec', 'rails', 'db:migrate:redo']
+
+HEALTH_TIMEOUT = 600
+HEALTH_INTERVAL = 1.0
+
+
+# Function to hash the content of files and folders (recursively, in name order), skipping missing ones
+def content_hash(paths):
+    digest = hashlib.sha256()
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, folders, files in os.walk(path):
+                folders.sort()
+                for name in sorted(files):
+                    file_path = os.path.join(directory, name)
+                    digest.update(os.path.relpath(file_path, path).encode())
+                    digest.update(migration.file_hash(file_path).encode())
+        elif os.path.isfile(path):
+            digest.update(os.path.basename(path).encode())
+            digest.update(migration.file_hash(path).encode())
+    return digest.hexdigest()
+
+
+# Function to hash the build files of a service's image
+def image_hash(service):
+    return content_hash([os.path.join(service['path'], name) for name in service['build_files']])
+
+
+# Function to hash the dataset loaded into the local ETM: data.csv and the migration (folder and .rb file)
+def dataset_hash(migration_name, migrate_path=migration.MIGRATE_PATH, data_path=generator.OUTPUT_PATH):
+    return content_hash([
+        data_path,
+        os.path.join(migrate_path, migration_name),
+        os.path.join(migrate_path, f'{migration_name}.rb')
+    ])
+
+
+# Function to load the hashes of the images and dataset used by the last start
+def load_state(path=STATE_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+
+# Function to save the hashes of the images and dataset in use
+def save_state(state, path=STATE_PATH):
+    with generator.atomic_write(path) as file:
+        json.dump(state, file, indent=2)
+
+
+# Function to check once whether a service answers, any response below 500 meaning it is up
+def is_healthy(url, timeout=2.0):
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            return response.status < 500
+    except urllib.error.HTTPError as e:
+        return e.code < 500
+    except (urllib.error.URLError, OSError):
+        return False
+
+
+# Function to poll a service until it answers, returning the seconds waited
+def wait_until_healthy(url, timeout=HEALTH_TIMEOUT, interval=HEALTH_INTERVAL):
+    start = time.monotonic()
+    while not is_healthy(url):
+        if time.monotonic() - start > timeout:
+            raise TimeoutError(f"{url} did not answer within {timeout} seconds")
+        time.sleep(interval)
+    return time.monotonic() - start
+
+
+# Services and dataset run in Docker, through docker compose in each repository
+class DockerEngine:
+    name = 'docker'
+
+    def _compose(self, path, *args):
+        result = subprocess.run(COMPOSE + list(args), cwd=path, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"{' '.join(COMPOSE + list(args))} failed in {path}: {result.stderr.strip()}")
+        return result.stdout
+
+    # Function to check whether the images of a service were already built
+    def image_exists(self, service):
+        images = self._compose(service['path'], 'config', '--images').split()
+        return bool(images) and all(
+            subprocess.run(['docker', 'image', 'inspect', image], capture_output=True).returncode == 0
+            for image in images
+        )
+
+    def build(self, service):
+        self._compose(service['path'], 'build')
+
+    def start(self, service):
+        self._compose(service['path'], 'up', '-d')
+
+    def stop(self, service):
+        self._compose(service['path'], 'down')
+
+    def load_dataset(self, migration_name):
+        version = migration.migration_timestamp(migration_name)
+        if not version:
+            raise RuntimeError(f"{migration_name} has no timestamp prefix, so it cannot be loaded into etlocal")
+        self._compose(ETLOCAL_PATH, *DATASET_COMMAND, f'VERSION={version}')
+
+
+# Stand-in for Docker that serves a health page on each service's port, to test the stack offline
+class StubEngine:
+    name = 'stub'
+
+    def __init__(self, startup_delay=0.0):
+        self.startup_delay = startup_delay
+        self.images = set()
+        self.servers = {}
+        self.datasets = []
+
+    def image_exists(self, service):
+        return service['path'] in self.images
+
+    def build(self, service):
+        self.images.add(service['path'])
+
+    def start(self, service):
+        address = urlparse(service['url'])
+        if address.port in self.servers:
+            return
+
+        # Unavailable until the startup delay has passed, like a container that takes a while to boot
+        ready_at = time.monotonic() + self.startup_delay
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200 if time.monotonic() >= ready_at else 503)
+                self.end_headers()
+                self.wfile.write(b'ok')
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer((address.hostname, address.port), Handler)
+        self.servers[address.port] = server
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def stop(self, service):
+        server = self.servers.pop(urlparse(service['url']).port, None)
+        if server:
+            server.shutdown()
+            server.server_close()
+
+    def load_dataset(self, migration_name):
+        self.datasets.append(migration_name)
+
+
+# Engines shared by every rerun and session, so that the stub servers can be stopped again
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+# Function to get the Docker engine, or the offline stub engine
+def get_engine(stub=False):
+    name = 'stub' if stub else 'docker'
+    with _engines_lock:
+        if name not in _engines:
+            _engines[name] = StubEngine() if stub else DockerEngine()
+        return _engines[name]
+
+
+def _run_concurrently(tasks):
+    results = []
+    errors = []
+    with ThreadPoolExecutor(max_workers=len(tasks) or 1) as executor:
+        futures = {executor.submit(task): name for name, task in tasks.items()}
+        for future in as_completed(futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                errors.append(f"{futures[future]}: {e}")
+    if errors:
+        raise RuntimeError('; '.join(errors))
+    return results
+
+
+# Function to start the local ETM: images whose build files changed are rebuilt and the dataset is reloaded
+# if data.csv or the migration changed (all concurrently), then every service is started and awaited concurrently
+# Returns the (step, outcome, seconds) of each step
+def start_stack(engine, migration_name=None, services=SERVICES, force=False, timeout=HEALTH_TIMEOUT,
+                state_path=STATE_PATH, migrate_path=migration.MIGRATE_PATH):
+    state = load_state(state_path)
+    cached = state.get(engine.name, {})
+    state_lock = threading.Lock()
+
+    def record(cache_key, digest):
+        with state_lock:
+            cached[cache_key] = digest
+            state[engine.name] = cached
+            save_state(state, state_path)
+
+    def build(name, service):
+        start = time.monotonic()
+        digest = image_hash(service)
+        if not force and cached.get(f'image:{name}') == digest and engine.image_exists(service):
+            return (f'{name} image', 'reused', time.monotonic() - start)
+        engine.build(service)
+        record(f'image:{name}', digest)
+        return (f'{name} image', 'built', time.monotonic() - start)
+
+    def load_dataset():
+        start = time.monotonic()
+        digest = dataset_hash(migration_name, migrate_path)
+        if not force and cached.get('dataset') == digest:
+            return ('dataset', 'reused', time.monotonic() - start)
+        engine.load_dataset(migration_name)
+        record('dataset', digest)
+        return ('dataset', 'loaded', time.monotonic() - start)
+
+    def start(name, service):
+        begin = time.monotonic()
+        engine.start(service)
+        wait_until_healthy(service['url'], timeout)
+        return (name, 'healthy', time.monotonic() - begin)
+
+    tasks = {f'{name} image': (lambda name=name, service=service: build(name, service)) for name, service in services.items()}
+    if migration_name:
+        tasks['dataset'] = load_dataset
+    steps = _run_concurrently(tasks)
+    steps += _run_concurrently({name: (lambda name=name, service=service: start(name, service)) for name, service in services.items()})
+    return steps
+
+
+# Function to stop every service of the local ETM
+def stop_stack(engine, services=SERVICES):
+    _run_concurrently({name: (lambda service=service: engine.stop(service)) for name, service in services.items()})
+
+
+# Function to check which services answer, as (name, url, healthy)
+def stack_status(services=SERVICES):
+    return [(name, service['url'], is_healthy(service['url'])) for name, service in services.items()]
+
+
+# Function to parse the command-line arguments
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Start or stop a local run of the ETM (etengine and etmodel).')
+    parser.add_argument('command', choices=['up', 'down', 'status'])
+    parser.add_argument('--migration', help='etlocal migration to load (defaults to the most recent one)')
+    parser.add_argument('--no-dataset', action='store_true', help='start the services without loading a dataset')
+    parser.add_argument('--rebuild', action='store_true', help='rebuild the images and reload the dataset even if unchanged')
+    parser.add_argument('--timeout', type=int, default=HEALTH_TIMEOUT, help='seconds to wait for each service to answer')
+    parser.add_argument('--stub', action='store_true',
+                        help='use a local stub instead of Docker, serving the health pages until the command exits')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    engine = get_engine(args.stub)
+
+    if args.command == 'status':
+        for name, url, healthy in stack_status():
+            print(f"{name}: {url} {'up' if healthy else 'down'}")
+        return 0
+
+    try:
+        if args.command == 'down':
+            stop_stack(engine)
+            print("Local ETM stopped")
+            return 0
+
+        migration_name = None
+        if not args.no_dataset:
+            migration_name = args.migration or migration.get_most_recent_migration()
+            if not migration_name:
+                print("No migration found, use --migration or --no-dataset", file=sys.stderr)
+                return 1
+        for step, outcome, seconds in start_stack(engine, migration_name, force=args.rebuild, timeout=args.timeout):
+            print(f"{step}: {outcome} ({seconds:.1f} s)")
+    except FileNotFoundError as e:
+        print(f"File not found: {e.filename}", file=sys.stderr)
+        return 1
+    except (RuntimeError, TimeoutError) as e:
+        print(f"Failed: {e}", file=sys.stderr)
+        return 1
+    print("Local ETM running: " + ', '.join(f"{name} at {service['url']}" for name, service in SERVICES.items()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
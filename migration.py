@@ -0,0 +1,97 @@
+import hashlib
+import os
+import shutil
+import threading
+
+from generator import atomic_write
+
+MIGRATE_PATH = os.path.join('..', 'etlocal', 'db', 'migrate')
+
+RB_ORIGINAL = 'CSVImporter.run(data_path, commits_path)'
+RB_PATCHED = 'CSVImporter.run(data_path, commits_path, create_missing_datasets: true)'
+
+# Most recent migration of each migrate folder, keyed by path and kept until the folder's mtime changes
+_recent_cache = {}
+_recent_lock = threading.Lock()
+
+
+# Function to hash the content of a file
+def file_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Function to check whether two files have the same content, comparing sizes before hashes
+def same_content(source, destination):
+    if not os.path.exists(destination):
+        return False
+    if os.path.getsize(source) != os.path.getsize(destination):
+        return False
+    return file_hash(source) == file_hash(destination)
+
+
+# Function to copy a file unless the destination already has the same content; returns whether it was copied
+def copy_if_changed(source, destination):
+    if same_content(source, destination):
+        return False
+    shutil.copyfile(source, destination)
+    return True
+
+
+# Function to get the timestamp prefix of a migration name (e.g. 20240101120000 in 20240101120000_vanuatu)
+def migration_timestamp(name):
+    prefix = name.split('_', 1)[0]
+    return prefix if prefix.isdigit() else None
+
+
+# Function to find the most recent migration folder from the timestamp prefixes of its name
+def find_most_recent_migration(migrate_path=MIGRATE_PATH):
+    most_recent = None
+    untimestamped = []
+    with os.scandir(migrate_path) as entries:
+        for entry in entries:
+            if not entry.is_dir():
+                continue
+            timestamp = migration_timestamp(entry.name)
+            if timestamp is None:
+                untimestamped.append(entry)
+            elif most_recent is None or (len(timestamp), timestamp) > most_recent[0]:
+                most_recent = ((len(timestamp), timestamp), entry.name)
+    if most_recent:
+        return most_recent[1]
+    if untimestamped:
+        # Only folders without a timestamp prefix: fall back to their creation time
+        return max(untimestamped, key=lambda entry: entry.stat().st_ctime).name
+    return None
+
+
+# Function to get the most recent migration folder, cached until the migrate folder changes
+def get_most_recent_migration(migrate_path=MIGRATE_PATH):
+    path = os.path.abspath(migrate_path)
+    mtime = os.stat(path).st_mtime_ns
+    with _recent_lock:
+        cached = _recent_cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    most_recent = find_most_recent_migration(path)
+    with _recent_lock:
+        _recent_cache[path] = (mtime, most_recent)
+    return most_recent
+
+
+# Function to make the CSVImporter.run command of a migration create missing datasets
+# The .rb file is only rewritten (atomically) when it still needs the change; returns whether it was changed
+def update_rb_file(migration_name, migrate_path=MIGRATE_PATH):
+    rb_file_path = os.path.join(migrate_path, f'{migration_name}.rb')
+    with open(rb_file_path, 'r', encoding='utf-8') as file:
+        content = file.read()
+
+    updated = content.replace(RB_ORIGINAL, RB_PATCHED)
+    if updated == content:
+        return False
+    with atomic_write(rb_file_path) as file:
+        file.write(updated)
+    return True
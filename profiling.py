@@ -0,0 +1,47 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+
+PROFILE_LOG_PATH = os.path.join('output', 'profile.log')
+
+
+# Timings and counts of a single rerun of the application
+class RerunProfiler:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.timings = {}
+        self.counts = {}
+
+    # Function to time a block of code, adding up repeated sections with the same name
+    @contextmanager
+    def section(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+    # Function to count something created during the rerun, such as widgets
+    def count(self, name, amount=1):
+        self.counts[name] = self.counts.get(name, 0) + amount
+
+    # Function to get the time elapsed since the rerun started, in seconds
+    def total(self):
+        return time.perf_counter() - self.started
+
+    # Function to get the timings (in milliseconds) and counts of the rerun as a single record
+    def as_record(self, **extra):
+        record = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'total_ms': round(self.total() * 1000, 3)}
+        record.update({f'{name}_ms': round(seconds * 1000, 3) for name, seconds in self.timings.items()})
+        record.update(self.counts)
+        record.update(extra)
+        return record
+
+    # Function to append the record of the rerun to a JSON lines log file
+    def export(self, path=PROFILE_LOG_PATH, **extra):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'a') as file:
+            file.write(json.dumps(self.as_record(**extra)) + '\n')
@@ -0,0 +1,45 @@
+import bisect
+import re
+
+TOKEN_SEPARATORS = re.compile(r'[\s_()/,-]+')
+
+
+# Function to build a search index over rows of text fields (key, translation, level, typology, ...)
+# holding the lowercase text of each row for substring search and sorted tokens for prefix search
+def build_search_index(rows):
+    texts = ['\n'.join(row).lower() for row in rows]
+    tokens = set()
+    for i, row in enumerate(rows):
+        for field in row:
+            field = field.lower()
+            tokens.add((field, i))
+            tokens.update((token, i) for token in TOKEN_SEPARATORS.split(field) if token)
+    return {'texts': texts, 'tokens': sorted(tokens)}
+
+
+# Function to find the rows whose whole fields or words start with a prefix, in row order
+def search_prefix(index, query):
+    tokens = index['tokens']
+    matches = set()
+    position = bisect.bisect_left(tokens, (query, -1))
+    while position < len(tokens) and tokens[position][0].startswith(query):
+        matches.add(tokens[position][1])
+        position += 1
+    return sorted(matches)
+
+
+# Function to find the rows containing a substring, in row order
+# Spaces also match the underscores of keys, so "hot water" finds steam_hot_water keys
+def search_substring(index, query):
+    key_query = query.replace(' ', '_')
+    return [i for i, text in enumerate(index['texts']) if query in text or key_query in text]
+
+
+# Function to search the index, returning every row for an empty query
+def search(index, query, mode='substring'):
+    query = query.strip().lower()
+    if not query:
+        return list(range(len(index['texts'])))
+    if mode == 'prefix':
+        return search_prefix(index, query)
+    return search_substring(index, query)
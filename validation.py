@@ -0,0 +1,126 @@
+import argparse
+import csv
+import re
+import sys
+from functools import lru_cache
+
+import numpy as np
+
+# Keys holding text rather than numbers
+TEXT_KEYS = ('geo_id', 'country', 'name')
+
+# Key families whose values must lie within a range, as (family, pattern, minimum, maximum)
+RANGE_RULES = [
+    ('share', re.compile(r'^input_percentage_of_|_(parent|child|loss)_share$'), 0.0, 1.0),
+    ('CO2 conversion', re.compile(r'^file_carriers_\w+_co2_conversion_per_mj$'), 0.0, 1.0),
+]
+
+# Key families whose values must add up to 1 for each group (or all be 0 when the group is unused),
+# as (family, pattern capturing the group)
+SUM_RULES = [
+    ('input_percentage_of', re.compile(r'^input_percentage_of_.+?_([a-z]+_final_demand_.+)$')),
+]
+
+TOLERANCE = 1e-4
+
+
+# Function to build the validation schema of a list of keys as arrays aligned with the keys
+@lru_cache(maxsize=32)
+def build_schema(keys):
+    numeric = np.array([key not in TEXT_KEYS for key in keys], dtype=bool)
+    lower = np.full(len(keys), -np.inf)
+    upper = np.full(len(keys), np.inf)
+    families = [''] * len(keys)
+    groups = {}
+    group_ids = np.full(len(keys), -1, dtype=int)
+
+    for i, key in enumerate(keys):
+        for family, pattern, minimum, maximum in RANGE_RULES:
+            if pattern.search(key):
+                lower[i], upper[i], families[i] = minimum, maximum, family
+                break
+        for family, pattern in SUM_RULES:
+            match = pattern.match(key)
+            if match:
+                group_ids[i] = groups.setdefault(f'{family}_*_{match.group(1)}', len(groups))
+                break
+
+    # One column per group, so every group sum of every row is a single matrix product
+    membership = np.zeros((len(keys), len(groups)))
+    membership[group_ids >= 0, group_ids[group_ids >= 0]] = 1.0
+    return {
+        'numeric': numeric,
+        'lower': lower,
+        'upper': upper,
+        'families': families,
+        'group_labels': list(groups),
+        'membership': membership
+    }
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+
+# Function to validate rows of data.csv values, returning one (row, key, value, problem) tuple per violation
+def validate_rows(header, records):
+    if not records:
+        return []
+    header = tuple(header)
+    schema = build_schema(header)
+    width = len(header)
+    raw = np.array([list(record[:width]) + [''] * (width - len(record)) for record in records], dtype=str)
+    # Converted in a single pass, NaN where a value is not a number
+    numbers = np.fromiter((_to_float(value) for value in raw.ravel()), dtype=float, count=raw.size).reshape(raw.shape)
+    finite = np.isfinite(numbers)
+    numeric = schema['numeric']
+
+    missing = (np.char.str_len(np.char.strip(raw)) == 0) & numeric
+    not_numeric = ~finite & ~missing & numeric
+    out_of_range = finite & ((numbers < schema['lower']) | (numbers > schema['upper']))
+
+    violations = []
+    for mask, problem in ((missing, 'missing value'), (not_numeric, 'not a number')):
+        for row, column in zip(*np.nonzero(mask)):
+            violations.append((int(row), header[column], str(raw[row, column]), problem))
+    for row, column in zip(*np.nonzero(out_of_range)):
+        problem = f"{schema['families'][column]} outside [{schema['lower'][column]:g}, {schema['upper'][column]:g}]"
+        violations.append((int(row), header[column], str(raw[row, column]), problem))
+
+    if schema['group_labels']:
+        sums = np.where(finite, numbers, 0.0) @ schema['membership']
+        bad_sums = (np.abs(sums - 1.0) > TOLERANCE) & (np.abs(sums) > TOLERANCE)
+        for row, group in zip(*np.nonzero(bad_sums)):
+            violations.append((int(row), schema['group_labels'][group], f'{sums[row, group]:g}', 'does not add up to 1'))
+    return violations
+
+
+# Function to validate a single data.csv row given as a {key: value} dict
+def validate_row(row):
+    return [violation[1:] for violation in validate_rows(list(row), [list(row.values())])]
+
+
+# Function to validate every row of a data.csv file
+def validate_file(path):
+    with open(path, newline='', encoding='utf-8-sig') as file:
+        records = csv.reader(file)
+        header = next(records, [])
+        return validate_rows(header, list(records))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Validate the values of a data.csv file.')
+    parser.add_argument('path', help='data.csv file to validate')
+    args = parser.parse_args(argv)
+    violations = validate_file(args.path)
+    for row, key, value, problem in violations:
+        print(f"row {row + 1}: {key} = '{value}': {problem}")
+    print(f"{len(violations)} violations found in {args.path}")
+    return 1 if violations else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())